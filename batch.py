@@ -0,0 +1,260 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import contextlib
+import dataclasses
+import io
+import json
+import pathlib
+import sys
+import time
+
+try:
+    import resource  # not available on Windows
+    HaveResource = True
+except ImportError:
+    HaveResource = False
+
+import export
+
+
+# When expanding a directory into input files, skip files with these
+# extensions (they're probably our own output files)
+IGNORED_SUFFIXES = {'.txt', '.json', '.wmsc', '.md'}
+
+
+@dataclasses.dataclass
+class BatchResult:
+    """
+    The result of analyzing or exporting a single input file
+    """
+    path: pathlib.Path
+    ok: bool
+    elapsed: float
+    output: str = ''
+    error: str = None
+    profile_json: dict = None
+
+
+def expand_input_paths(paths: list) -> list:
+    """
+    Expand a list of paths (files and/or directories) to a list of
+    (input_file, relative_path) tuples, where relative_path is the
+    input's path relative to the directory it was found in (or just its
+    name, if it was listed explicitly). Directories are searched
+    recursively, except for RAM dump folders, which are inputs
+    themselves.
+    """
+    inputs = []
+
+    def add(path: pathlib.Path, relative_path: pathlib.Path):
+        # (relative_path is None for paths that were listed explicitly)
+        explicit = relative_path is None
+        if explicit:
+            relative_path = pathlib.Path(path.name)
+
+        if path.is_dir():
+            if export.get_folder_source_class(path)[0] is not None:
+                inputs.append((path, relative_path))
+            else:
+                parent = pathlib.Path() if explicit else relative_path
+                for child in sorted(path.iterdir()):
+                    add(child, parent / child.name)
+        elif explicit or path.suffix.lower() not in IGNORED_SUFFIXES:
+            inputs.append((path, relative_path))
+
+    for path in paths:
+        add(path, None)
+
+    return inputs
+
+
+def get_output_bases(inputs: list, output_dir: pathlib.Path = None) -> list:
+    """
+    Return a list of output base paths (to append ".txt" and ".json"
+    to), parallel to a list from expand_input_paths(). Outputs go next
+    to their inputs, or, if output_dir is specified, at their relative
+    paths under it. Inputs that would otherwise share outputs (like
+    "main.rpx" and "main.dol", or two "main.rpx"s from different input
+    directories) get their full file names instead (like
+    "main.dol.txt"), and then a number if needed.
+    """
+    bases = []
+    used = set()
+
+    for path, relative_path in inputs:
+        if output_dir is None:
+            parent = path.parent
+        else:
+            parent = output_dir / relative_path.parent
+
+        candidates = [parent / path.stem, parent / path.name]
+        candidates.extend(parent / f'{path.name}-{n}' for n in range(2, len(inputs) + 2))
+
+        for base in candidates:
+            # (Compare case-insensitively, in case the file system is)
+            key = str(base).casefold()
+            if key not in used:
+                break
+
+        used.add(key)
+        bases.append(base)
+
+    return bases
+
+
+def init_worker(cache_dir: pathlib.Path, cache_max_size: int, memory_limit: int) -> None:
+    """
+    Initializer for worker processes
+    """
+    if cache_dir is not None:
+        export.enable_caches(cache_dir, cache_max_size)
+
+    if memory_limit is not None and HaveResource:
+        # RLIMIT_DATA doesn't count read-only file mappings (like
+        # memory-mapped RAM dumps), which is what we want, but it isn't
+        # available everywhere
+        limit_type = getattr(resource, 'RLIMIT_DATA', resource.RLIMIT_AS)
+        resource.setrlimit(limit_type, (memory_limit, memory_limit))
+
+
+def run_one(command: str, path: pathlib.Path, out_base: pathlib.Path, *, profile: str = None, table_search_range: tuple = None) -> BatchResult:
+    """
+    Analyze or export a single input file (in a worker process), and
+    return a BatchResult. For exports, out_base is from
+    get_output_bases(). profile and table_search_range are passed on to
+    export.do_analyze() or export.do_export().
+    """
+    start_time = time.perf_counter()
+    output = io.StringIO()
+    # (The json profile report is written to stderr)
+    profile_output = io.StringIO()
+
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(profile_output):
+            if command == 'analyze':
+                export.do_analyze(path, profile=profile, table_search_range=table_search_range)
+
+            else:
+                export.do_export(path,
+                    out_base.with_name(out_base.name + '.txt'),
+                    out_base.with_name(out_base.name + '.json'),
+                    profile=profile,
+                    table_search_range=table_search_range)
+
+        profile_json = None
+        if profile == 'json':
+            profile_json = json.loads(profile_output.getvalue())
+
+    except Exception as e:
+        return BatchResult(path, False, time.perf_counter() - start_time,
+            output.getvalue(), f'{type(e).__name__}: {e}')
+
+    return BatchResult(path, True, time.perf_counter() - start_time, output.getvalue(),
+        profile_json=profile_json)
+
+
+def print_summary_table(results: list) -> None:
+    """
+    Print a table of all results, with per-file timings
+    """
+    names = [str(result.path) for result in results]
+    name_width = max([len('File')] + [len(n) for n in names])
+
+    print()
+    print(f'{"File":<{name_width}}  Status  Time (s)')
+    print(f'{"-" * name_width}  ------  --------')
+    for name, result in zip(names, results):
+        status = 'ok' if result.ok else 'FAILED'
+        print(f'{name:<{name_width}}  {status:<6}  {result.elapsed:8.2f}')
+
+    num_failed = sum(1 for result in results if not result.ok)
+    total_time = sum(result.elapsed for result in results)
+    print()
+    print(f'{len(results)} files, {num_failed} failed, {total_time:.2f}s total processing time')
+
+
+def do_batch(command: str, paths: list, *,
+        output_dir: pathlib.Path = None,
+        workers: int = None,
+        memory_limit: int = None,
+        cache_dir: pathlib.Path = None,
+        cache_max_size: int = None,
+        profile: str = None,
+        table_search_range: tuple = None) -> int:
+    """
+    Handle the "batch" command: run the "analyze" or "export" command on
+    many inputs in parallel, printing results as they finish and a
+    summary table at the end.
+    memory_limit is per worker process, in bytes.
+    If profile is 'table', each input's profile table is printed with
+    its result. If it's 'json', the reports are printed to stderr at the
+    end, as one json object keyed by input path.
+    table_search_range is used for every input.
+    Return the number of inputs that failed.
+    """
+    inputs = expand_input_paths(paths)
+    if not inputs:
+        print('No input files found')
+        return 0
+
+    out_bases = get_output_bases(inputs, output_dir)
+    if output_dir is not None and command == 'export':
+        for parent in {out_base.parent for out_base in out_bases}:
+            parent.mkdir(parents=True, exist_ok=True)
+    inputs = [path for path, _ in inputs]
+
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(cache_dir, cache_max_size, memory_limit)) as executor:
+
+        futures = {executor.submit(run_one, command, path, out_base,
+                profile=profile, table_search_range=table_search_range): path
+            for path, out_base in zip(inputs, out_bases)}
+
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. the worker process was killed
+                result = BatchResult(path, False, 0, error=f'{type(e).__name__}: {e}')
+
+            results[path] = result
+
+            # Stream the result
+            if result.ok:
+                print(f'[ok] {path} ({result.elapsed:.2f}s)')
+            else:
+                print(f'[FAILED] {path} ({result.elapsed:.2f}s): {result.error}')
+            if command == 'analyze' or not result.ok or profile == 'table':
+                for line in result.output.splitlines():
+                    print(f'    {line}')
+
+    ordered_results = [results[path] for path in inputs]
+    print_summary_table(ordered_results)
+
+    if profile == 'json':
+        reports = {str(result.path): result.profile_json
+            for result in ordered_results if result.profile_json is not None}
+        print(json.dumps(reports, indent=4), file=sys.stderr)
+
+    return sum(1 for result in ordered_results if not result.ok)
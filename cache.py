@@ -0,0 +1,205 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import mmap
+import os
+import pathlib
+import tempfile
+
+
+# Environment variable that can be used to enable caching without
+# passing --cache-dir every time
+CACHE_DIR_ENV_VAR = 'COBRA_CACHE_DIR'
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def get_default_cache_dir() -> pathlib.Path:
+    """
+    Return the cache directory specified by the COBRA_CACHE_DIR
+    environment variable, or None if it's not set
+    """
+    value = os.environ.get(CACHE_DIR_ENV_VAR)
+    if value:
+        return pathlib.Path(value)
+
+
+def hash_file_range(file, offset: int, size: int, *, block_size: int = 0x100000) -> str:
+    """
+    Return a hex digest of `size` bytes of a file-like object, starting
+    at `offset`
+    """
+    h = hashlib.sha256()
+
+    file.seek(offset)
+    while size > 0:
+        block = file.read(min(block_size, size))
+        if not block:
+            break
+        h.update(block)
+        size -= len(block)
+
+    return h.hexdigest()
+
+
+def fingerprint_file(file, *, num_samples: int = 16, sample_size: int = 0x1000) -> str:
+    """
+    Return a quick fingerprint of a file-like object: its size, plus a
+    hash of some blocks sampled evenly throughout it (always including
+    the first and last ones). Much faster than hashing huge files (like
+    RAM dumps) in full, and good enough for recognizing files we've
+    seen before.
+    """
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+
+    h = hashlib.sha256()
+    h.update(size.to_bytes(8, 'big'))
+
+    if size <= num_samples * sample_size:
+        offsets = [0]
+        sample_size = size
+    else:
+        step = (size - sample_size) // (num_samples - 1)
+        offsets = [i * step for i in range(num_samples)]
+
+    for offset in offsets:
+        file.seek(offset)
+        h.update(file.read(sample_size))
+
+    return f'{size:x}-{h.hexdigest()}'
+
+
+class DirectoryCache:
+    """
+    A simple content-addressed cache of binary blobs, stored as one file
+    per key in a directory. When the total size goes over max_size, the
+    least-recently-used entries are evicted.
+    """
+    def __init__(self, path: pathlib.Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def path_for(self, key: str) -> pathlib.Path:
+        """
+        Return the path of the file for the specified key
+        """
+        return self.path / key
+
+
+    def touch(self, path: pathlib.Path):
+        """
+        Mark a cache file as recently used
+        """
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+    def get_bytes(self, key: str) -> bytes:
+        """
+        Return the data for the specified key, or None if not cached
+        """
+        path = self.path_for(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touch(path)
+        return data
+
+
+    def get_mmap(self, key: str) -> mmap.mmap:
+        """
+        Return a read-only memory mapping of the data for the specified
+        key, or None if not cached
+        """
+        path = self.path_for(key)
+        try:
+            with path.open('rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touch(path)
+        return mapping
+
+
+    def put(self, key: str, data: bytes):
+        """
+        Store data for the specified key, and evict old entries if
+        needed. Failures to write are silently ignored -- it's only a
+        cache.
+        """
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+            # Write to a temporary file first and then rename it, so
+            # that concurrent readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, self.path_for(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+        except OSError:
+            return
+
+        self.evict()
+
+
+    def evict(self):
+        """
+        Delete least-recently-used entries until the total size is at
+        most self.max_size
+        """
+        entries = []
+        total_size = 0
+
+        try:
+            for entry in os.scandir(self.path):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total_size += st.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
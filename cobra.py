@@ -19,6 +19,8 @@ import argparse
 import pathlib
 import typing
 
+import batch
+import cache
 import common
 import docs
 import encode
@@ -31,24 +33,66 @@ def main(argv:list=None) -> None:
     subparsers = parser.add_subparsers(title='commands',
         description='(run a command with -h for additional help)')
 
+    def add_cache_arguments(subparser):
+        """
+        Add the caching-related arguments to a subparser
+        """
+        subparser.add_argument('--cache-dir', type=pathlib.Path, default=cache.get_default_cache_dir(),
+            help=f'directory to cache analysis results, decompressed executable sections and encoded scripts in (default: ${cache.CACHE_DIR_ENV_VAR}, or no caching if unset)')
+        subparser.add_argument('--cache-max-size', type=int, default=cache.DEFAULT_MAX_SIZE // (1024 * 1024),
+            help='maximum size of the cache, in MiB (least-recently-used entries are evicted beyond this)')
+
+    def add_profile_argument(subparser):
+        """
+        Add the --profile argument to a subparser
+        """
+        subparser.add_argument('--profile', nargs='?', const='table', choices=['table', 'json'],
+            help='print the time and I/O spent in each phase, as a table (default) or json (to stderr)')
+
+    def add_table_search_range_argument(subparser):
+        """
+        Add the --table-search-range argument to a subparser
+        """
+        subparser.add_argument('--table-search-range', nargs=2, type=lambda s: int(s, 0), metavar=('START', 'END'),
+            help='address range to search for the scripts table in if it\'s not at a known address, e.g. "0x00b00000 0x00d00000" (default: depends on the game)')
+
+    def setup_cache(pArgs):
+        """
+        Enable caching according to the arguments added by
+        add_cache_arguments()
+        """
+        if pArgs.cache_dir is None:
+            return
+
+        export.enable_caches(pArgs.cache_dir, pArgs.cache_max_size * 1024 * 1024)
+        encode.enable_caches(pArgs.cache_dir, pArgs.cache_max_size * 1024 * 1024)
+
     def handle_analyze(pArgs):
         """
         Handle the "analyze" command.
         """
+        setup_cache(pArgs)
+
         input_file = pArgs.input_file
 
-        export.do_analyze(input_file)
+        export.do_analyze(input_file, profile=pArgs.profile,
+            table_search_range=pArgs.table_search_range)
 
     parser_analyze = subparsers.add_parser('analyze', aliases=['a'],
         help='analyze a code file or memory dump, and print findings')
     parser_analyze.add_argument('input_file', type=pathlib.Path,
         help='file to inspect')
+    add_cache_arguments(parser_analyze)
+    add_profile_argument(parser_analyze)
+    add_table_search_range_argument(parser_analyze)
     parser_analyze.set_defaults(func=handle_analyze)
 
     def handle_export(pArgs):
         """
         Handle the "export" command.
         """
+        setup_cache(pArgs)
+
         input_file = pArgs.input_file
 
         scripts_file = pArgs.scripts_file
@@ -57,7 +101,10 @@ def main(argv:list=None) -> None:
         version_info_file = pArgs.version_info_file
         if version_info_file is None: version_info_file = input_file.with_suffix('.json')
 
-        export.do_export(input_file, scripts_file, version_info_file)
+        export.do_export(input_file, scripts_file, version_info_file,
+            from_version_info_file=pArgs.from_version_info,
+            profile=pArgs.profile,
+            table_search_range=pArgs.table_search_range)
 
     parser_export = subparsers.add_parser('export', aliases=['ex'],
         help='export all scripts from a code file or memory dump')
@@ -67,19 +114,65 @@ def main(argv:list=None) -> None:
         help='output file to save scripts to (.txt)')
     parser_export.add_argument('version_info_file', nargs='?', type=pathlib.Path,
         help='output file to save important autodetected info to (.json)')
+    parser_export.add_argument('--from-version-info', type=pathlib.Path,
+        help='use an existing version-info file (.json) for this input file instead of re-analyzing it')
+    add_cache_arguments(parser_export)
+    add_profile_argument(parser_export)
+    add_table_search_range_argument(parser_export)
     parser_export.set_defaults(func=handle_export)
 
+    def handle_batch(pArgs):
+        """
+        Handle the "batch" command.
+        """
+        memory_limit = pArgs.memory_limit
+        if memory_limit is not None: memory_limit *= 1024 * 1024
+
+        num_failed = batch.do_batch(pArgs.batch_command, pArgs.inputs,
+            output_dir=pArgs.output_dir,
+            workers=pArgs.jobs,
+            memory_limit=memory_limit,
+            cache_dir=pArgs.cache_dir,
+            cache_max_size=pArgs.cache_max_size * 1024 * 1024,
+            profile=pArgs.profile,
+            table_search_range=pArgs.table_search_range)
+
+        if num_failed:
+            raise SystemExit(1)
+
+    parser_batch = subparsers.add_parser('batch',
+        help='analyze or export many code files and/or memory dumps in parallel')
+    parser_batch.add_argument('batch_command', choices=['analyze', 'export'],
+        help='command to run on each input')
+    parser_batch.add_argument('inputs', nargs='+', type=pathlib.Path,
+        help='files to process, or folders to search (recursively) for them')
+    parser_batch.add_argument('-o', '--output-dir', type=pathlib.Path,
+        help='folder to save exported files to, keeping the subfolders they were found in (default: next to each input file)')
+    parser_batch.add_argument('-j', '--jobs', type=int,
+        help='number of worker processes (default: number of CPUs)')
+    parser_batch.add_argument('--memory-limit', type=int,
+        help='memory limit per worker process, in MiB (not supported on Windows)')
+    add_cache_arguments(parser_batch)
+    add_profile_argument(parser_batch)
+    add_table_search_range_argument(parser_batch)
+    parser_batch.set_defaults(func=handle_batch)
+
     def handle_encode(pArgs):
         """
         Handle the "encode" command.
         """
+        setup_cache(pArgs)
+
         scripts_file = pArgs.scripts_file
         version_info_file = pArgs.version_info_file
 
         wmsc_file = pArgs.wmsc_file
         if wmsc_file is None: wmsc_file = scripts_file.with_suffix('.wmsc')
 
-        encode.do_encode(scripts_file, version_info_file, wmsc_file)
+        if pArgs.watch:
+            encode.do_encode_watch(scripts_file, version_info_file, wmsc_file, poll_interval=pArgs.poll_interval)
+        else:
+            encode.do_encode(scripts_file, version_info_file, wmsc_file)
 
     parser_encode = subparsers.add_parser('encode', aliases=['en'],
         help='convert a scripts file to a .wmsc binary file')
@@ -89,6 +182,11 @@ def main(argv:list=None) -> None:
         help="a version-info file (.json) characterizing the particular version of the game you're going to be using this with")
     parser_encode.add_argument('wmsc_file', nargs='?', type=pathlib.Path,
         help='output .wmsc file to save to')
+    parser_encode.add_argument('--watch', action='store_true',
+        help='keep running, and re-encode whenever the scripts file, version-info file or game data changes')
+    parser_encode.add_argument('--poll-interval', type=float, default=0.25,
+        help='how often to check for changes with --watch, in seconds (default: 0.25)')
+    add_cache_arguments(parser_encode)
     parser_encode.set_defaults(func=handle_encode)
 
     def handle_docs(pArgs):
@@ -15,19 +15,26 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
-import dataclasses
+import array
+import collections.abc
 import enum
+import sys
 
 
-def iter_bytes_matches(haystack: bytes, needle: bytes):
+# array typecode for u32s (it's 'I' on every common platform, but the C
+# standard only guarantees that to be at least 2 bytes)
+U32_TYPECODE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+def encode_u32_array(values: list, endian: str) -> bytes:
     """
-    Given a big bytes object and a small one, iterate over indices at
-    which the small one is a substring of the big one
+    Encode a list of u32s to bytes with the given endianness ('>' or
+    '<'), all at once
     """
-    idx = haystack.find(needle)
-    while idx != -1:
-        yield idx
-        idx = haystack.find(needle, idx + 1)
+    values = array.array(U32_TYPECODE, values)
+    if (endian == '>') != (sys.byteorder == 'big'):
+        values.byteswap()
+    return values.tobytes()
 
 
 def convert_str_keys_to_int_keys(map: dict) -> dict:
@@ -82,44 +89,272 @@ class Game(enum.Enum):
             return '<'
 
 
-@dataclasses.dataclass
 class LowLevelCommand:
     """
     Represents a "low-level" command -- an (ID, argument) pair, both ints.
     """
+    __slots__ = ('id', 'argument')
+
     id: int
-    argument: int = 0
+    argument: int
 
-    def __init__(self, id: int, argument: int):
+    def __init__(self, id: int, argument: int = 0):
         self.id = id
         self.argument = argument
 
+    def __repr__(self):
+        return f'{type(self).__name__}(id={self.id!r}, argument={self.argument!r})'
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return (self.id, self.argument) == (other.id, other.argument)
+
+    __hash__ = None
+
+
+def command_words(commands) -> list:
+    """
+    Flatten an iterable of LowLevelCommand into a list of interleaved
+    (ID, argument) ints
+    """
+    words = []
+    for command in commands:
+        words.append(command.id)
+        words.append(command.argument)
+    return words
+
 
-class LowLevelScript(list):
+class LowLevelScript(collections.abc.MutableSequence):
     """
-    `list` subclass representing a "low-level" script -- a list of LowLevelCommand
+    Represents a "low-level" script -- a list of LowLevelCommand.
+    The commands are stored compactly, as one array of interleaved
+    (ID, argument) u32s (the same layout as in .wmsc files), and
+    LowLevelCommands are only created when accessed. If a value doesn't
+    fit in a u32 (values from the interpreter might not), it falls back
+    to a plain list of ints.
     """
-    priority: int = 0
+    __slots__ = ('words', 'priority')
+
+    words: array.array
+    priority: int
+
+    def __init__(self, commands: list = ()):
+        self.words = array.array(U32_TYPECODE)
+        self.priority = 0
+        for command in commands:
+            self.append(command)
+
+    @classmethod
+    def from_words(cls, words: list):
+        """
+        Create from a flat list of interleaved (ID, argument) ints
+        """
+        script = cls()
+        script.extend_words(words)
+        return script
+
+
+    def extend_words(self, words: list):
+        """
+        Append commands from a flat list of interleaved (ID, argument)
+        ints
+        """
+        old_length = len(self.words)
+        try:
+            self.words.extend(words)
+        except (OverflowError, TypeError):
+            del self.words[old_length:]
+            if isinstance(self.words, array.array):
+                self.words = self.words.tolist()
+            self.words.extend(words)
+
+
+    def iter_pairs(self):
+        """
+        Iterate over (ID, argument) tuples, without creating
+        LowLevelCommands
+        """
+        return zip(self.words[0::2], self.words[1::2])
+
+
+    def encode(self, endian: str) -> bytes:
+        """
+        Encode the commands as they appear in .wmsc data
+        """
+        if isinstance(self.words, array.array):
+            if (endian == '>') != (sys.byteorder == 'big'):
+                words = array.array(U32_TYPECODE, self.words)
+                words.byteswap()
+                return words.tobytes()
+            return self.words.tobytes()
+        return encode_u32_array(self.words, endian)
+
+
+    def splice_words(self, start: int, end: int, words: list):
+        """
+        Replace self.words[start:end] with a flat list of interleaved
+        (ID, argument) ints
+        """
+        tail = self.words[end:]
+        del self.words[start:]
+        self.extend_words(words)
+        self.extend_words(tail)
+
+
+    def copy(self) -> 'LowLevelScript':
+        """
+        Return a shallow copy, like list.copy()
+        """
+        script = type(self)()
+        script.words = self.words[:]
+        script.priority = self.priority
+        return script
+
+
+    def sort(self, *, key=None, reverse: bool = False):
+        """
+        Sort the commands in place, like list.sort()
+        """
+        commands = sorted(self, key=key, reverse=reverse)
+        self.splice_words(0, len(self.words), command_words(commands))
+
+
+    def __len__(self) -> int:
+        return len(self.words) // 2
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                script = type(self)()
+                script.words = self.words[start * 2 : max(start, stop) * 2]
+                return script
+            return type(self)(self[i] for i in range(start, stop, step))
+        index = range(len(self))[index]
+        return LowLevelCommand(self.words[index * 2], self.words[index * 2 + 1])
+
+
+    def __iter__(self):
+        for id, argument in self.iter_pairs():
+            yield LowLevelCommand(id, argument)
+
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                self.splice_words(start * 2, max(start, stop) * 2, command_words(value))
+                return
+
+            indices = range(start, stop, step)
+            commands = list(value)
+            if len(commands) != len(indices):
+                raise ValueError(f'attempt to assign sequence of size {len(commands)} to extended slice of size {len(indices)}')
+            for i, command in zip(indices, commands):
+                self[i] = command
+            return
+
+        index = range(len(self))[index]
+        self.splice_words(index * 2, index * 2 + 2, [value.id, value.argument])
+
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                del self.words[start * 2 : max(start, stop) * 2]
+                return
+            for i in sorted(range(start, stop, step), reverse=True):
+                del self[i]
+            return
+        index = range(len(self))[index]
+        del self.words[index * 2 : index * 2 + 2]
+
+
+    def insert(self, index: int, command: LowLevelCommand):
+        index = max(0, min(len(self), index + len(self) if index < 0 else index))
+        self.splice_words(index * 2, index * 2, [command.id, command.argument])
+
+
+    def append(self, command: LowLevelCommand):
+        self.extend_words([command.id, command.argument])
+
+
+    def extend(self, commands):
+        if isinstance(commands, LowLevelScript):
+            self.extend_words(commands.words)
+        else:
+            self.extend_words(command_words(commands))
+
+
+    def __add__(self, other):
+        if not isinstance(other, (LowLevelScript, list)):
+            return NotImplemented
+        script = self.copy()
+        script.extend(other)
+        return script
+
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        script = type(self)(other)
+        script.extend(self)
+        return script
+
+
+    def __eq__(self, other):
+        if isinstance(other, LowLevelScript):
+            return list(self.words) == list(other.words)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self)!r})'
 
 
 
-@dataclasses.dataclass
 class HighLevelCommand:
     """
     Represents a "high-level" command -- an (ID, argument) pair, both strings.
     argument is optional at this level. (The value is implied to be 0 in that case.)
+    The ID is interned, since there are only a few hundred distinct ones.
     """
+    __slots__ = ('id', 'argument')
+
     id: str
-    argument: str = None
+    argument: str
 
-    def __init__(self, id: str, argument: str):
-        self.id = id
+    def __init__(self, id: str, argument: str = None):
+        self.id = sys.intern(id)
         self.argument = argument
 
+    def __repr__(self):
+        return f'{type(self).__name__}(id={self.id!r}, argument={self.argument!r})'
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return (self.id, self.argument) == (other.id, other.argument)
+
+    __hash__ = None
+
 
 class HighLevelScript(list):
     """
     `list` subclass representing a "high-level" script -- a list of HighLevelCommand
     """
-    priority: int = None
+    __slots__ = ('priority',)
+
+    priority: int
+
+    def __init__(self, commands: list = ()):
+        super().__init__(commands)
+        self.priority = None
 
@@ -201,7 +201,7 @@ def do_docs() -> None:
 
         variants = game_variants.load_game_json(game)
 
-        input_file = pathlib.Path(f'data/{game.value}_template.md')
+        input_file = game_variants.DATA_DIR / f'{game.value}_template.md'
         output_file = pathlib.Path(f'docs/{game.value}.md')
 
         text = input_file.read_text(encoding='utf-8')
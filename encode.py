@@ -15,40 +15,31 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import json
+import marshal
 import pathlib
 import re
-import struct
+import time
 
+import cache
 import common
 import game_variants
+import wmsc
 
 
-RE_SCRIPT_HEADER_LINE = re.compile(
-    r'(?P<name>\w+)'      # name
-    r'\s*'                # (optional whitespace)
-    r'(?:'                # optional group for priority value
-    r'\['                 # | literal "["
-    r'\s*'                # | (optional whitespace)
-    r'priority'           # | literal "priority"
-    r'\s*'                # | (optional whitespace)
-    r'='                  # | literal "="
-    r'\s*'                # | (optional whitespace)
-    r'(?P<priority>\d+)'  # | priority value
-    r'\s*'                # | (optional whitespace)
-    r'\]'                 # | literal "]"
-    r')?'                 # (ending the group)
-    r':'                  # literal ":"
-)
+# Encoded form of each scripts-file chunk seen so far in this process
+# (see encode_scripts_file()), keyed by get_script_cache_key()
+encoded_scripts = {}
+
+# Optional cache.DirectoryCache for the same, to share them between runs
+script_cache = None
+
+# Bump this whenever a change to the parsing, conversion or encoding
+# code could change encoded scripts, to invalidate old script_cache
+# entries
+SCRIPT_CACHE_VERSION = 3
 
-RE_COMMAND_LINE = re.compile(
-    r'(?P<id>\w+)'        # ID
-    r'\s*'                # (optional whitespace)
-    r'(?:'                # optional group for argument
-    r'\s'                 # | (required whitespace)
-    r'(?P<arg>\w+)'       # | argument
-    r')?'                 # (ending the group)
-)
 
 RE_SCRIPT_DEFAULT_NAME = re.compile(
     r'scr_'               # literal "scr_"
@@ -60,73 +51,103 @@ RE_COMMAND_DEFAULT_NAME = re.compile(
     r'(?P<id>\d+)'        # ID
 )
 
-class ScriptsFileReader:
+
+def is_word(s: str) -> bool:
     """
-    Class for reading scripts files
+    Check if a string is nonempty and consists only of word characters
+    (same as the regex "\\w+")
     """
-    def __init__(self, file):
-        self.file = file
-        self.scripts = {}
+    return s.replace('_', 'a').isalnum()
 
-        self.current_script_name = None
-        self.current_script = None
 
-    def read_all_from_file(self) -> None:
-        """
-        Read all lines from self.file
-        """
-        for i, line in enumerate(self.file):
-            line = line.rstrip('\n')
-            self.read_line(line, i)
+def tokenize_line(line: str) -> tuple:
+    """
+    Classify and split a line of a scripts file in a single pass.
+    Return ('script', name, priority) for a script-header line (priority
+    may be None), ('command', id, arg) for a command line (arg may be
+    None), or None for a blank or comment-only line. Raise ValueError if
+    the line isn't valid.
+    """
+    line = line.partition('#')[0].strip()
+    if not line:
+        return None
+
+    if line.endswith(':'):
+        # Script header: "name:" or "name [priority=123]:"
+        header = line[:-1]
+        priority = None
+
+        if header.endswith(']'):
+            header, bracket, priority_str = header[:-1].partition('[')
+            key, equals, value = priority_str.partition('=')
+            value = value.strip()
+            if not bracket or not equals or key.strip() != 'priority' or not value.isdecimal():
+                raise ValueError
+            priority = int(value)
+
+        name = header.rstrip()
+        if not is_word(name):
+            raise ValueError
+        return ('script', name, priority)
+
+    # Command: "id" or "id arg"
+    parts = line.split()
+    if len(parts) > 2 or not is_word(''.join(parts)):
+        raise ValueError
+    return ('command', parts[0], parts[1] if len(parts) > 1 else None)
+
+
+def tokenize_lines(lines, *, first_line_num: int = 0):
+    """
+    Tokenize lines of a scripts file (an iterable of str's, such as a
+    file opened in text mode) with tokenize_line(), yielding
+    (line_num, token) tuples for the non-blank ones. first_line_num is
+    the line number of the first line, for error messages.
+    """
+    for line_num, line in enumerate(lines, first_line_num):
+        try:
+            token = tokenize_line(line)
+        except ValueError:
+            raise ValueError(f"Couldn't read line {line_num+1}") from None
+        if token is not None:
+            yield line_num, token
 
-        self.flush_current_script()
 
-    def read_line(self, line: str, line_num: int) -> None:
-        """
-        Read a single line from the script file.
-        line_num is only needed for error messages.
-        """
-        # Do some basic preprocessing
-        line = line.split('#')[0]  # comments
-        line = line.strip()
-        if not line: return
-
-        # Is it a script-header line?
-        match = RE_SCRIPT_HEADER_LINE.fullmatch(line)
-        if match:
-            gd = match.groupdict()
+def iter_scripts_from_tokens(tokens):
+    """
+    Parse (line_num, token) tuples from tokenize_lines(), yielding
+    (name, HighLevelScript) tuples as each script ends
+    """
+    script_name = None
+    script = None
 
-            self.flush_current_script()
-            self.current_script_name = gd['name']
-            self.current_script = common.HighLevelScript()
-            if gd.get('priority') is not None:
-                self.current_script.priority = int(gd['priority'])
-            return
+    for line_num, (kind, a, b) in tokens:
+        if kind == 'script':
+            if script is not None:
+                yield script_name, script
 
-        # Must be a command, then
-        match = RE_COMMAND_LINE.fullmatch(line)
-        if match:
-            gd = match.groupdict()
+            script_name = a
+            script = common.HighLevelScript()
+            if b is not None:
+                script.priority = b
 
-            if self.current_script is None:
+        else:
+            if script is None:
                 raise ValueError(f'Command not within any script (line {line_num+1})')
 
-            cmd = common.HighLevelCommand(gd['id'], gd.get('arg'))
-            self.current_script.append(cmd)
-            return
+            script.append(common.HighLevelCommand(a, b))
 
-        else:
-            raise ValueError(f"Couldn't read line {line_num+1}")
+    if script is not None:
+        yield script_name, script
 
-    def flush_current_script(self) -> None:
-        """
-        Flush self.current_script[_name] to self.scripts, and reset them
-        to None
-        """
-        if self.current_script is not None:
-            self.scripts[self.current_script_name] = self.current_script
-        self.current_script_name = None
-        self.current_script = None
+
+def iter_scripts(lines, *, first_line_num: int = 0):
+    """
+    Parse lines of a scripts file (an iterable of str's, such as a file
+    opened in text mode), yielding (name, HighLevelScript) tuples as
+    each script ends, so the whole file never needs to be in memory
+    """
+    return iter_scripts_from_tokens(tokenize_lines(lines, first_line_num=first_line_num))
 
 
 def read_scripts_file(file) -> dict:
@@ -134,9 +155,7 @@ def read_scripts_file(file) -> dict:
     Read a file-like object (text mode) and convert to a dict of
     {name: HighLevelScript}
     """
-    reader = ScriptsFileReader(file)
-    reader.read_all_from_file()
-    return reader.scripts
+    return dict(iter_scripts(file))
 
 
 def convert_to_low_level(high_level_scripts: dict, variant: game_variants.GameVariant) -> dict:
@@ -144,18 +163,16 @@ def convert_to_low_level(high_level_scripts: dict, variant: game_variants.GameVa
     Convert a dict of {name: HighLevelScript} to a dict of
     {id: LowLevelScript} according to the provided GameVariant
     """
+    scripts = variant.get_resolved_scripts()
+    commands = variant.get_resolved_commands()
+
     def get_script_info(name: str) -> (int, dict):
         """
         Get the correct ID and info dict for a script name
         """
-        this_variant = variant
-        while this_variant:
-            for other_id, other_dict in this_variant.scripts.add.items():
-                if name == other_dict.get('name'):
-                    return other_id, other_dict
-            for ren in this_variant.scripts.renumber:
-                id = ren.apply(id)
-            this_variant = this_variant.parent
+        id = scripts.id_by_name.get(name)
+        if id is not None:
+            return id, scripts.by_id[id]
 
         match = RE_SCRIPT_DEFAULT_NAME.fullmatch(name)
         if match:
@@ -167,14 +184,9 @@ def convert_to_low_level(high_level_scripts: dict, variant: game_variants.GameVa
         """
         Get the correct ID and info dict for a command name
         """
-        this_variant = variant
-        while this_variant:
-            for other_id, other_dict in this_variant.commands.add.items():
-                if name == other_dict.get('name'):
-                    return other_id, other_dict
-            for ren in this_variant.commands.renumber:
-                id = ren.apply(id)
-            this_variant = this_variant.parent
+        id = commands.id_by_name.get(name)
+        if id is not None:
+            return id, commands.by_id[id]
 
         match = RE_COMMAND_DEFAULT_NAME.fullmatch(name)
         if match:
@@ -206,75 +218,288 @@ def convert_to_low_level(high_level_scripts: dict, variant: game_variants.GameVa
                     if low_arg is None:
                         raise ValueError(f'Unable to understand argument: "{command_high.argument}"')
 
-            # Create LowLevelCommand and add it to the script
-            command_low = common.LowLevelCommand(command_id, low_arg)
-            script_low.append(command_low)
+            # Add the command to the script
+            script_low.extend_words((command_id, low_arg))
 
     return low_level_scripts
 
 
-def encode_wmsc(scripts: dict, *, endian: str, use_priorities: bool) -> bytes:
+def encode_script_commands(script: common.LowLevelScript, endian: str) -> bytes:
     """
-    Convert a dict of common.LowLevelScript to .wmsc file data
+    Encode the commands of a single common.LowLevelScript, as they
+    appear in .wmsc data
     """
-    data = bytearray()
-    table_entry_len = (8 if use_priorities else 4)
+    return script.encode(endian)
 
-    def u32(val: int) -> bytes:
-        return struct.pack(f'{endian}I', val)
 
-    # Number of scripts
-    data += u32(len(scripts))
+def get_wmsc_game(variant: game_variants.GameVariant) -> common.Game:
+    """
+    Return the game whose .wmsc format (endianness and scripts-table
+    layout) is used for the specified GameVariant. That's usually
+    variant.game, but the NSMBUDX variant is defined in the NSMBU json,
+    so the game character in its .wmsc ID takes precedence.
+    """
+    return wmsc.split_wmsc_id(wmsc.get_variant_wmsc_id(variant))[0]
 
-    # IDs table
-    for id in sorted(scripts):
-        data += u32(id)
 
-    # Scripts table (dummy at first)
-    scripts_table_ptr = len(data)
-    data += (b'\0' * table_entry_len) * len(scripts)
+def assemble_wmsc(scripts: dict, wmsc_id: str) -> bytes:
+    """
+    Build .wmsc file data from a dict of {id: (priority, commands_data)},
+    where commands_data is from encode_script_commands().
+    wmsc_id is the game character and game variant identifier to put
+    in the header (like "U130"). It also decides the endianness and
+    whether the scripts table has priorities.
+    """
+    game, _ = wmsc.split_wmsc_id(wmsc_id)
+    endian = game.endian()
+    use_priorities = game.uses_script_priorities()
 
-    # Each script
-    for id in sorted(scripts):
-        script = scripts[id]
+    ids = sorted(scripts)
+    table_entry_len = (8 if use_priorities else 4)
 
+    # Work out the layout first: the header, the IDs table, the scripts
+    # table, and then all of the scripts' commands
+    commands_offset = wmsc.HEADER_SIZE + 4 * len(ids) + table_entry_len * len(ids)
+
+    # Scripts table
+    scripts_table = []
+    offset = commands_offset
+    for id in ids:
+        priority, commands_data = scripts[id]
         if use_priorities:
-            table_entry = u32(script.priority) + u32(len(data))
-        else:
-            table_entry = u32(len(data))
+            scripts_table.append(priority)
+        scripts_table.append(offset)
+        offset += len(commands_data)
 
-        data[scripts_table_ptr : scripts_table_ptr + table_entry_len] = table_entry
-        scripts_table_ptr += table_entry_len
+    return b''.join([
+        wmsc.encode_header(wmsc_id, offset, len(ids)),
+        common.encode_u32_array([*ids, *scripts_table], endian),
+        *(scripts[id][1] for id in ids)])
 
-        for command in script:
-            data += u32(command.id) + u32(command.argument)
 
-    return bytes(data)
+def encode_wmsc(scripts: dict, wmsc_id: str) -> bytes:
+    """
+    Convert a dict of common.LowLevelScript to .wmsc file data for the
+    game variant with the specified .wmsc ID
+    """
+    endian = wmsc.split_wmsc_id(wmsc_id)[0].endian()
+    return assemble_wmsc(
+        {id: (script.priority, encode_script_commands(script, endian)) for id, script in scripts.items()},
+        wmsc_id)
 
 
-def do_encode(scripts_file: pathlib.Path, version_info_file: pathlib.Path, wmsc_file: pathlib.Path) -> None:
+def enable_caches(cache_dir: pathlib.Path, max_size: int = cache.DEFAULT_MAX_SIZE) -> None:
     """
-    Handle the "encode" command (with all default parameter values filled in as needed)
+    Enable the encoded-scripts cache, using a subdirectory of cache_dir
     """
-    # Load scripts file
-    with scripts_file.open('r', encoding='utf-8') as f:
-        scripts_high = read_scripts_file(f)
+    global script_cache
+    script_cache = cache.DirectoryCache(cache_dir / 'scripts', max_size)
+
+
+def iter_script_chunks(lines):
+    """
+    Split lines of a scripts file (an iterable of str's, such as a file
+    opened in text mode) into chunks that each contain (at most) one
+    script, by starting a new chunk at every script-header line. Yield
+    (first_line_num, lines) tuples as each chunk ends.
+    Lines are only fully tokenized later, if needed.
+    """
+    first_line_num = 0
+    chunk_lines = []
+
+    for line_num, line in enumerate(lines):
+        line = line.rstrip('\n')
+
+        # (Script-header lines always contain a colon)
+        if ':' in line and chunk_lines:
+            try:
+                token = tokenize_line(line)
+            except ValueError:
+                token = None  # (will be reported when the chunk is parsed)
+            if token is not None and token[0] == 'script':
+                yield first_line_num, chunk_lines
+                first_line_num = line_num
+                chunk_lines = []
 
-    # Load version-info file
+        chunk_lines.append(line)
+
+    if chunk_lines:
+        yield first_line_num, chunk_lines
+
+
+def get_script_cache_hasher(variant: game_variants.GameVariant):
+    """
+    Return a SHA-256 hasher that's been fed everything besides the
+    script text that goes into a script's cache key, for
+    get_script_cache_key()
+    """
+    h = hashlib.sha256()
+    h.update(f'{variant.game.value}\0{variant.id}\0'.encode('utf-8'))
+    h.update(game_variants.get_game_json_digest(variant.game).encode('ascii'))
+    return h
+
+
+def get_script_cache_key(lines: list, variant_hasher) -> str:
+    """
+    Return the key for the encoded form of a chunk of a scripts file in
+    encoded_scripts and script_cache. variant_hasher should come from
+    get_script_cache_hasher().
+    """
+    h = variant_hasher.copy()
+    h.update('\n'.join(lines).encode('utf-8'))
+    return f'v{SCRIPT_CACHE_VERSION}-{h.hexdigest()}'
+
+
+def encode_script_chunk(first_line_num: int, lines: list, variant: game_variants.GameVariant) -> tuple:
+    """
+    Parse, convert and encode a chunk from iter_script_chunks(). Return
+    (name, id, priority, commands_data), or None if the chunk doesn't
+    contain a script.
+    """
+    scripts = list(iter_scripts(lines, first_line_num=first_line_num))
+    if not scripts:
+        return None
+
+    [(name, script_high)] = scripts
+    [(id, script_low)] = convert_to_low_level({name: script_high}, variant).items()
+
+    return (name, id, script_low.priority, encode_script_commands(script_low, get_wmsc_game(variant).endian()))
+
+
+def encode_scripts_file(file, variant: game_variants.GameVariant) -> bytes:
+    """
+    Convert a scripts file (an iterable of lines, such as a file opened
+    in text mode) to .wmsc file data, one script at a time. Scripts
+    whose text hasn't changed since they were last encoded (in this
+    process, or in script_cache if enabled) aren't parsed or converted
+    again.
+    """
+    variant_hasher = get_script_cache_hasher(variant)
+    used_keys = set()
+
+    scripts_by_name = {}
+    for first_line_num, lines in iter_script_chunks(file):
+        key = get_script_cache_key(lines, variant_hasher)
+        used_keys.add(key)
+
+        if key in encoded_scripts:
+            encoded = encoded_scripts[key]
+        else:
+            cached = None if script_cache is None else script_cache.get_bytes(key)
+            if cached is not None:
+                encoded = marshal.loads(cached)
+            else:
+                encoded = encode_script_chunk(first_line_num, lines, variant)
+                if script_cache is not None:
+                    script_cache.put(key, marshal.dumps(encoded))
+            encoded_scripts[key] = encoded
+
+        if encoded is not None:
+            name, id, priority, commands_data = encoded
+            scripts_by_name[name] = (id, priority, commands_data)
+
+    # Forget chunks that aren't in the file anymore, so that rebuilding
+    # with --watch doesn't keep every old version of every script
+    for key in encoded_scripts.keys() - used_keys:
+        del encoded_scripts[key]
+
+    # (If multiple scripts have the same name or ID, the last one wins,
+    # like with read_scripts_file() and convert_to_low_level())
+    scripts = {}
+    for id, priority, commands_data in scripts_by_name.values():
+        scripts[id] = (priority, commands_data)
+
+    return assemble_wmsc(scripts, wmsc.get_variant_wmsc_id(variant))
+
+
+def get_variant_from_version_info_file(version_info_file: pathlib.Path) -> game_variants.GameVariant:
+    """
+    Load a version-info file and return the GameVariant it specifies
+    """
     with version_info_file.open('r', encoding='utf-8') as f:
         version_info = json.load(f)
 
-    # Get a GameVariant instance
     variants = game_variants.load_game_json(common.Game(version_info['game']))
-    variant = variants[version_info['game_variant']]
+    return variants[version_info['game_variant']]
 
-    # Convert high- to low-level scripts
-    scripts_low = convert_to_low_level(scripts_high, variant)
 
-    # Encode and save .wmsc data
-    wmsc_data = encode_wmsc(scripts_low,
-        endian=variant.game.endian(),
-        use_priorities=variant.game.uses_script_priorities())
+def get_file_stamp(path: pathlib.Path) -> tuple:
+    """
+    Return a (mtime, size) tuple that changes whenever the file does,
+    or None if it doesn't exist
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def do_encode(scripts_file: pathlib.Path, version_info_file: pathlib.Path, wmsc_file: pathlib.Path) -> None:
+    """
+    Handle the "encode" command (with all default parameter values filled in as needed)
+    """
+    # Get a GameVariant instance
+    variant = get_variant_from_version_info_file(version_info_file)
+
+    # Read the scripts file and convert it to .wmsc data, reusing
+    # previously encoded scripts if possible
+    with scripts_file.open('r', encoding='utf-8') as f:
+        wmsc_data = encode_scripts_file(f, variant)
 
     with wmsc_file.open('wb') as f:
         f.write(wmsc_data)
+
+
+def do_encode_watch(scripts_file: pathlib.Path, version_info_file: pathlib.Path, wmsc_file: pathlib.Path, *, poll_interval: float = 0.25) -> None:
+    """
+    Handle the "encode --watch" command: encode, and then poll the input
+    files (and the game json) and re-encode whenever any of them
+    change, until interrupted with Ctrl+C. The .wmsc file is only
+    rewritten if its contents actually change.
+    """
+    try:
+        last_wmsc_data = wmsc_file.read_bytes()
+    except OSError:
+        last_wmsc_data = None
+
+    stamps = {}
+    print(f'Watching {scripts_file} and {version_info_file} (press Ctrl+C to stop)')
+
+    try:
+        while True:
+            if any(get_file_stamp(path) != stamp for path, stamp in stamps.items()) or not stamps:
+                start_time = time.perf_counter()
+                watched_files = [scripts_file, version_info_file]
+                stamps = {path: get_file_stamp(path) for path in watched_files}
+
+                try:
+                    variant = get_variant_from_version_info_file(version_info_file)
+                    game_json_file = game_variants.DATA_DIR / f'{variant.game.value}.json'
+                    stamps[game_json_file] = get_file_stamp(game_json_file)
+
+                    already_encoded = set(encoded_scripts)
+                    with scripts_file.open('r', encoding='utf-8') as f:
+                        wmsc_data = encode_scripts_file(f, variant)
+                    num_encoded = len(encoded_scripts.keys() - already_encoded)
+
+                except (OSError, ValueError, KeyError) as e:
+                    print(f'[{time.strftime("%H:%M:%S")}] Error: {e}')
+
+                else:
+                    if wmsc_data != last_wmsc_data:
+                        with wmsc_file.open('wb') as f:
+                            f.write(wmsc_data)
+                        last_wmsc_data = wmsc_data
+                        result = f'wrote {wmsc_file}'
+                    else:
+                        result = 'output unchanged'
+
+                    elapsed = time.perf_counter() - start_time
+                    print(f'[{time.strftime("%H:%M:%S")}] Encoded in {elapsed * 1000:.1f} ms'
+                        f' ({num_encoded} script(s) re-encoded), {result}')
+
+            time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        pass
@@ -18,6 +18,7 @@
 import contextlib
 import enum
 import json
+import os
 import pathlib
 import struct
 import typing
@@ -27,7 +28,19 @@ import export_nsmbw
 import export_nsmbu
 import export_nsmbudx
 
+import cache
 import common
+import game_variants
+import profiling
+
+
+# Optional cache.DirectoryCache for analysis results, keyed by a
+# fingerprint of the input file
+analysis_cache = None
+
+# Bump this whenever a change to the analysis code could change its
+# results, to invalidate old analysis_cache entries
+ANALYSIS_CACHE_VERSION = 1
 
 
 EXPORT_MODULES = [
@@ -42,65 +55,258 @@ ANALYSIS_FOR_SOURCE = {
 }
 
 
+# Number of bytes from the start of each file to pass to
+# SourceFormat.matches()
+HEADER_PROBE_SIZE = 0x100
+
+# Maximum number of commands to read from a single script before giving
+# up on finding its terminator
+MAX_SCRIPT_LENGTH = 999
+
+
+def get_folder_source_class(path: pathlib.Path) -> (type, pathlib.Path):
+    """
+    If the given folder is a RAM dump folder, return the Source subclass
+    for it and the path to the file within it to open. Otherwise return
+    (None, None).
+    """
+    for export_module in EXPORT_MODULES:
+        for filename, source_class in export_module.FOLDER_SOURCES.items():
+            file_path = path / filename
+            if file_path.is_file():
+                return source_class, file_path
+
+    return None, None
+
+
+def get_source_class(header: bytes, size: int) -> type:
+    """
+    Return the Source subclass for a file with the given header (first
+    HEADER_PROBE_SIZE bytes) and total size, or None if it's not
+    recognized
+    """
+    for export_module in EXPORT_MODULES:
+        for source_format in export_module.SOURCE_FORMATS:
+            if source_format.matches(header, size):
+                return source_format.source_class
+
+
 @contextlib.contextmanager
 def open_source(path: pathlib.Path):
     """
     Context manager.
-    If the given Path can be recognized as a Source for this game, yield
-    that as the `with` target. Otherwise the `with` target will be None.
+    If the given Path can be recognized as a Source, yield that as the
+    `with` target. Otherwise raise ValueError.
+    The file is only opened once: its header and size are checked
+    against each module's SOURCE_FORMATS, and then the matching Source
+    is constructed using the same file object.
     """
-    if not (path.is_file() or path.is_dir()):
+    if path.is_dir():
+        source_class, file_path = get_folder_source_class(path)
+        if file_path is None:
+            raise ValueError(f'Unable to determine source type for {path.name}')
+    elif path.is_file():
+        source_class, file_path = None, path
+    else:
         raise ValueError(f'File or folder not found: {path}')
 
-    for export_module in EXPORT_MODULES:
-        with export_module.try_open_source(path) as source:
-            if source is not None:
-                yield source
-                return
+    with file_path.open('rb') as f:
+        if source_class is None:
+            size = os.fstat(f.fileno()).st_size
+            header = f.read(HEADER_PROBE_SIZE)
+            source_class = get_source_class(header, size)
 
-    raise ValueError(f'Unable to determine source type for {path.name}')
+        if source_class is None:
+            raise ValueError(f'Unable to determine source type for {path.name}')
 
+        source = source_class(f)
+        try:
+            yield source
+        finally:
+            source.close()
 
-def get_analysis_for_source(source: export_base.Source) -> export_base.Analysis:
+
+def enable_caches(cache_dir: pathlib.Path, max_size: int = cache.DEFAULT_MAX_SIZE) -> None:
+    """
+    Enable the analysis-results and decompressed-sections caches, using
+    subdirectories of cache_dir
+    """
+    global analysis_cache
+    export_base.decompressed_section_cache = cache.DirectoryCache(cache_dir / 'sections', max_size)
+    analysis_cache = cache.DirectoryCache(cache_dir / 'analysis', max_size)
+
+
+def get_analysis_for_source(source: export_base.Source, *, table_search_range: tuple = None) -> export_base.Analysis:
     """
     Return the appropriate Analysis subclass for the given Source.
+    If table_search_range is provided, it overrides the analysis's
+    default (start, end) address range to search for the scripts table
+    in.
     """
     if source.game in ANALYSIS_FOR_SOURCE:
-        return ANALYSIS_FOR_SOURCE[source.game](source)
+        return ANALYSIS_FOR_SOURCE[source.game](source, table_search_range=table_search_range)
     else:
         raise NotImplementedError(f'Unknown analysis class for {source}')
 
 
-def read_scripts(source: export_base.Source, analysis: export_base.Analysis) -> list:
+def load_analysis_from_version_info(analysis: export_base.Analysis, version_info: dict) -> None:
     """
-    Return a list of LowLevelScripts
+    Fill in an Analysis's results from a version-info dict (as saved by
+    do_export()) instead of running the analysis. The only memory reads
+    this does are for re-running the interpreter, if the source needs
+    it, since memory overrides aren't saved in version-info files.
     """
-    scripts = []
-    for i in range(analysis.table_length):
-        script = common.LowLevelScript()
-
-        # Read the entry from scripts table
-        if analysis.uses_priorities:
-            source.seek(analysis.table_addr + i * 8)
-            script.priority = source.read_u32()
-            script_addr = source.read_u32()
-        else:
-            script_addr = source.read_u32_from(analysis.table_addr + i * 4)
+    game = common.Game(version_info['game'])
+    if game is not analysis.source.game.gets_scripts_and_commands_from():
+        raise ValueError(f'Version info is for {game.value}, but the input file is {analysis.source.game.value}')
 
-        # Read the script itself
-        source.seek(script_addr)
-        for j in range(999):
-            command_id = analysis.read_commands_u32_from(script_addr + j * 8 + 0)
-            arg = analysis.read_commands_u32_from(script_addr + j * 8 + 4)
+    analysis.load_json(version_info)
 
-            script.append(common.LowLevelCommand(command_id, arg))
+    if analysis.uses_static_init_func and analysis.source.needs_interpreter:
+        analysis.memory_overrides = analysis.run_interpreter()
 
-            if command_id == analysis.terminator_command:
-                break
 
+def get_analysis_cache_key(analysis: export_base.Analysis) -> str:
+    """
+    Return the analysis_cache key for an Analysis's Source. Besides the
+    input file, results depend on the table search range and on the
+    game json (variants and address hints), so those are included too.
+    """
+    source = analysis.source
+    fingerprint = cache.fingerprint_file(source.file)
+    start, end = analysis.table_search_range
+    json_digest = game_variants.get_game_json_digest(source.game.gets_scripts_and_commands_from())
+    return f'v{ANALYSIS_CACHE_VERSION}-{type(source).__name__}-{fingerprint}-{start:x}-{end:x}-{json_digest}'
+
+
+def analyze_source(source: export_base.Source, *, verbose: bool = True, version_info: dict = None, profiler: profiling.Profiler = None, table_search_range: tuple = None) -> export_base.Analysis:
+    """
+    Return an Analysis for the given Source with all of its results
+    filled in. If version_info (a dict previously returned by
+    Analysis.to_json()) is provided, the results are taken from that.
+    Otherwise, they're loaded from analysis_cache, or if that's not
+    possible, by actually running the analysis.
+    If a profiler is provided, each phase is recorded in it.
+    table_search_range is passed on to get_analysis_for_source().
+    """
+    analysis = get_analysis_for_source(source, table_search_range=table_search_range)
+    analysis.profiler = profiler
+
+    if version_info is not None:
+        with analysis.phase('load version info'):
+            load_analysis_from_version_info(analysis, version_info)
+        if verbose:
+            print('(Using provided version info)')
+            analysis.print_summary()
+        return analysis
+
+    if analysis_cache is None:
+        analysis.analyze(verbose=verbose)
+        return analysis
+
+    key = get_analysis_cache_key(analysis)
+
+    with analysis.phase('analysis cache lookup'):
+        cached = analysis_cache.get_bytes(key)
+        if cached is not None:
+            try:
+                cached = json.loads(cached)
+                analysis.load_json(cached['analysis'])
+                analysis.memory_overrides = common.convert_str_keys_to_int_keys(cached['memory_overrides'])
+            except (ValueError, KeyError):
+                cached = None  # ignore corrupt or outdated entries, and just redo it
+
+    if cached is not None:
+        if verbose:
+            print('(Using cached analysis results)')
+            analysis.print_summary()
+        return analysis
+
+    analysis.analyze(verbose=verbose)
+
+    cached = {
+        'analysis': analysis.to_json(),
+        'memory_overrides': {hex(addr): value for addr, value in analysis.memory_overrides.items()},
+    }
+    analysis_cache.put(key, json.dumps(cached).encode('utf-8'))
+
+    return analysis
+
+
+def group_script_addrs(script_addrs: list) -> list:
+    """
+    Group script addresses into runs that can be read together, as
+    lists of sorted, distinct addresses. A new group starts wherever a
+    script couldn't possibly extend into the next one.
+    """
+    groups = []
+    for addr in sorted(set(script_addrs)):
+        if (groups
+                and addr - groups[-1][-1] <= MAX_SCRIPT_LENGTH * 8
+                and (addr - groups[-1][0]) % 4 == 0):
+            groups[-1].append(addr)
         else:
+            groups.append([addr])
+    return groups
+
+
+def parse_script_body(values: list, start: int, terminator_command: int) -> (list, bool):
+    """
+    Parse a script from a list of u32s, starting at index `start`.
+    Return its words (interleaved command IDs and arguments), and
+    whether the terminator command was found.
+    """
+    end = min(start + MAX_SCRIPT_LENGTH * 2, len(values))
+    command_ids = values[start:end:2]
+    num_commands = (end - start) // 2
+
+    try:
+        num_commands = command_ids.index(terminator_command, 0, num_commands) + 1
+        terminated = True
+    except ValueError:
+        terminated = False
+
+    return values[start:start + num_commands * 2], terminated
+
+
+def read_scripts(source: export_base.Source, analysis: export_base.Analysis) -> list:
+    """
+    Return a list of LowLevelScripts
+    """
+    table = source.read_u32_array(analysis.table_addr,
+        analysis.table_length * (2 if analysis.uses_priorities else 1))
+
+    if analysis.uses_priorities:
+        priorities = table[0::2]
+        script_addrs = table[1::2]
+    else:
+        priorities = [0] * analysis.table_length
+        script_addrs = table
+
+    # Read the commands region around each group of nearby scripts in
+    # one go, and parse each distinct script body once (multiple table
+    # entries can point to the same one)
+    bodies = {}
+    for group in group_script_addrs(script_addrs):
+        region_start = group[0]
+        values = analysis.read_commands_u32_prefix(region_start,
+            (group[-1] - region_start) // 4 + MAX_SCRIPT_LENGTH * 2)
+
+        for addr in group:
+            bodies[addr] = parse_script_body(values, (addr - region_start) // 4,
+                analysis.terminator_command)
+
+    scripts = []
+    for i, (priority, script_addr) in enumerate(zip(priorities, script_addrs)):
+        words, terminated = bodies[script_addr]
+
+        if not terminated:
+            if len(words) < MAX_SCRIPT_LENGTH * 2:
+                raise ValueError(f'Script {i} runs off the end of readable memory')
             print(f'WARNING: Terminator not found (script {i})')
 
+        script = common.LowLevelScript.from_words(words)
+        script.priority = priority
         scripts.append(script)
 
     return scripts
@@ -110,35 +316,12 @@ def convert_to_high_level(low_level_scripts: list, analysis: export_base.Analysi
     """
     Convert a list of LowLevelScript to a dict of {name: HighLevelScript}
     """
-    def get_script_info(id: int) -> dict:
-        """
-        Get the correct info dict for a script ID
-        """
-        variant = analysis.game_variant
-        while variant:
-            if id in variant.scripts.add:
-                return variant.scripts.add[id]
-            for ren in variant.scripts.renumber:
-                id = ren.apply(id)
-            variant = variant.parent
-        return {}
-
-    def get_command_info(id: int) -> dict:
-        """
-        Get the correct info dict for a command ID
-        """
-        variant = analysis.game_variant
-        while variant:
-            if id in variant.commands.add:
-                return variant.commands.add[id]
-            for ren in variant.commands.renumber:
-                id = ren.apply(id)
-            variant = variant.parent
-        return {}
+    scripts = analysis.game_variant.get_resolved_scripts()
+    commands = analysis.game_variant.get_resolved_commands()
 
     high_level_scripts = {}
     for i, script_low in enumerate(low_level_scripts):
-        script_info = get_script_info(i)
+        script_info = scripts.get_info(i)
 
         # Make HighLevelScript and add it to the dict by name
         script_high = common.HighLevelScript()
@@ -146,11 +329,11 @@ def convert_to_high_level(low_level_scripts: list, analysis: export_base.Analysi
 
         script_high.priority = script_low.priority
 
-        for command_low in script_low:
-            command_info = get_command_info(command_low.id)
+        for command_id, argument in script_low.iter_pairs():
+            command_info = commands.get_info(command_id)
 
             # Command ID (simple)
-            high_id = command_info.get('name', f'cmd_{command_low.id:03d}')
+            high_id = command_info.get('name', f'cmd_{command_id:03d}')
 
             # Command arg (a little more complicated)
             high_arg = None
@@ -158,19 +341,16 @@ def convert_to_high_level(low_level_scripts: list, analysis: export_base.Analysi
             # If the command is documented to have an argument...
             if command_info.get('arg') is not None:
                 # Use a string from an enum if applicable
-                for name, value in command_info.get('enum', {}).items():
-                    if command_low.argument == value:
-                        high_arg = name
-                        break
-                else:
+                high_arg = commands.get_enum_name(command_id, argument)
+                if high_arg is None:
                     # No enum matches, but the command *is* still
                     # documented to have an argument, so add it here
                     # whether it's zero or not
-                    high_arg = str(command_low.argument)
+                    high_arg = str(argument)
 
             # Otherwise, only add the arg if it's nonzero
-            if high_arg is None and command_low.argument != 0:
-                high_arg = str(command_low.argument)
+            if high_arg is None and argument != 0:
+                high_arg = str(argument)
 
             # Create HighLevelCommand and add it to the script
             command_high = common.HighLevelCommand(high_id, high_arg)
@@ -211,41 +391,66 @@ def convert_to_text(scripts: dict) -> str:
     return '\n'.join(lines)
 
 
-def do_analyze(input_file: pathlib.Path) -> None:
+def do_analyze(input_file: pathlib.Path, *, profile: str = None, table_search_range: tuple = None) -> None:
     """
-    Handle the "analyze" command
+    Handle the "analyze" command.
+    If profile is 'table' or 'json', print a report of the cost of each
+    analysis phase in that format afterward.
+    table_search_range is passed on to get_analysis_for_source().
     """
     print(f'Analyzing "{input_file.name}"...')
 
     with open_source(input_file) as source:
         print(f'Source type: {source.name}')
 
-        analysis = get_analysis_for_source(source)
-        analysis.analyze(verbose=True)
+        profiler = None if profile is None else profiling.Profiler(source)
+
+        analyze_source(source, verbose=True, profiler=profiler, table_search_range=table_search_range)
+
+        if profiler is not None:
+            profiler.print_report(profile)
 
 
-def do_export(input_file: pathlib.Path, scripts_file: pathlib.Path, version_info_file: pathlib.Path) -> None:
+def do_export(input_file: pathlib.Path, scripts_file: pathlib.Path, version_info_file: pathlib.Path, *, from_version_info_file: pathlib.Path = None, profile: str = None, table_search_range: tuple = None) -> None:
     """
-    Handle the "export" command (with all default parameter values filled in as needed)
+    Handle the "export" command (with all default parameter values filled in as needed).
+    If profile is 'table' or 'json', print a report of the cost of each
+    phase in that format afterward.
+    table_search_range is passed on to get_analysis_for_source().
     """
+    # Load existing version-info file, if provided
+    version_info = None
+    if from_version_info_file is not None:
+        with from_version_info_file.open('r', encoding='utf-8') as f:
+            version_info = json.load(f)
+
     with open_source(input_file) as source:
 
+        profiler = None if profile is None else profiling.Profiler(source)
+
         # Analyze
-        analysis = get_analysis_for_source(source)
-        analysis.analyze()
+        analysis = analyze_source(source, version_info=version_info, profiler=profiler,
+            table_search_range=table_search_range)
 
-        # Save analysis results
-        analysis_json = analysis.to_json()
-        with version_info_file.open('w', encoding='utf-8') as f:
-            json.dump(analysis_json, f, indent=4)
+        # Save analysis results (unless we'd just be overwriting the
+        # file we got them from)
+        if from_version_info_file is None or from_version_info_file.resolve() != version_info_file.resolve():
+            analysis_json = analysis.to_json()
+            with version_info_file.open('w', encoding='utf-8') as f:
+                json.dump(analysis_json, f, indent=4)
 
         # Read low-level (int-based) scripts
-        scripts_low = read_scripts(source, analysis)
+        with analysis.phase('read scripts'):
+            scripts_low = read_scripts(source, analysis)
 
         # Convert to high-level (str-based) scripts
-        scripts_high = convert_to_high_level(scripts_low, analysis)
+        with analysis.phase('convert to high level'):
+            scripts_high = convert_to_high_level(scripts_low, analysis)
 
         # Save output
         txt = convert_to_text(scripts_high)
         with scripts_file.open('w', encoding='utf-8') as f:
             f.write(txt)
+
+        if profiler is not None:
+            profiler.print_report(profile)
@@ -15,13 +15,153 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
+import array
+import bisect
+import contextlib
 import dataclasses
+import heapq
+import io
+import mmap
+import os
+import re
 import struct
+import sys
+import typing
 
+try:
+    import numpy  # pip install numpy
+    HaveNumPy = True
+except ImportError:
+    HaveNumPy = False
+
+import cache
 import common
 import game_variants
 
 
+# Optional cache.DirectoryCache for decompressed section data. If set,
+# compressed sections are looked up by the hash of their compressed
+# payload before being decompressed, and saved there afterward.
+decompressed_section_cache = None
+
+
+def decode_u32_array(data: bytes, endian: str) -> array.array:
+    """
+    Decode a bytes-like object (length must be a multiple of 4) to an
+    array of u32s with the given endianness ('>' or '<')
+    """
+    values = array.array(common.U32_TYPECODE)
+    values.frombytes(data)
+    if (endian == '>') != (sys.byteorder == 'big'):
+        values.byteswap()
+    return values
+
+
+class WordPattern:
+    """
+    A pattern of consecutive u32s (such as instructions), each of which
+    is given as a (mask, value) pair: a word matches if
+    (word & mask) == value. A mask of 0 matches anything.
+    The pattern can be searched for over a whole buffer at once, using
+    NumPy if available, or a compiled regex otherwise.
+    """
+    words: list
+
+    def __init__(self, words: list):
+        self.words = [(mask & 0xFFFFFFFF, value & mask) for mask, value in words]
+        self.regexes = {}  # {endian: compiled regex}
+
+
+    @staticmethod
+    def exact(value: int) -> (int, int):
+        """
+        (mask, value) pair for a word that must match exactly
+        """
+        return (0xFFFFFFFF, value)
+
+
+    ANY = (0, 0)
+
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+    def get_regex(self, endian: str) -> re.Pattern:
+        """
+        Compile the pattern to a bytes regex for the given endianness,
+        or return the one compiled previously.
+        Each byte becomes either a literal, "any byte", or a character
+        class of all byte values matching that byte of the mask.
+        """
+        if endian not in self.regexes:
+            parts = []
+            for mask, value in self.words:
+                mask_bytes = struct.pack(f'{endian}I', mask)
+                value_bytes = struct.pack(f'{endian}I', value)
+                for m, v in zip(mask_bytes, value_bytes):
+                    if m == 0:
+                        parts.append(b'.')
+                    elif m == 0xFF:
+                        parts.append(re.escape(bytes([v])))
+                    else:
+                        options = bytes(b for b in range(256) if b & m == v)
+                        parts.append(b'[' + re.escape(options) + b']')
+
+            # The lookahead lets matches overlap, so that an unaligned
+            # match can't hide an aligned one right after it
+            self.regexes[endian] = re.compile(b'(?=' + b''.join(parts) + b')', re.DOTALL)
+
+        return self.regexes[endian]
+
+
+    def find_all(self, data: bytes, endian: str) -> list:
+        """
+        Return a sorted list of all 4-aligned offsets in data at which
+        the pattern matches
+        """
+        num_words = len(data) // 4
+        num_positions = num_words - len(self.words) + 1
+        if num_positions <= 0:
+            return []
+
+        if HaveNumPy:
+            words = numpy.frombuffer(data, dtype=f'{endian}u4', count=num_words)
+
+            matches = numpy.ones(num_positions, dtype=bool)
+            for i, (mask, value) in enumerate(self.words):
+                if mask == 0: continue
+                window = words[i : i + num_positions]
+                if mask != 0xFFFFFFFF:
+                    window = window & mask
+                matches &= (window == value)
+
+            return [int(i) * 4 for i in numpy.flatnonzero(matches)]
+
+        return [m.start() for m in self.get_regex(endian).finditer(data) if m.start() % 4 == 0]
+
+
+    def matches(self, words: list) -> bool:
+        """
+        Check if a list of u32s (at least as long as the pattern) matches
+        the pattern, starting at the beginning
+        """
+        return all((word & mask) == value for word, (mask, value) in zip(words, self.words))
+
+
+def ppc_instruction(opcode: int, ra: int = None) -> (int, int):
+    """
+    (mask, value) pair for WordPattern, matching a PowerPC instruction
+    with the specified primary opcode and (optionally) rA field
+    """
+    mask = 0xFC000000
+    value = opcode << 26
+    if ra is not None:
+        mask |= 0x001F0000
+        value |= ra << 16
+    return (mask, value)
+
+
 class Source:
     """
     Source base class. Essentially a wrapper around a file object, which
@@ -34,27 +174,107 @@ class Source:
 
     def __init__(self, file):
         self.file = file
+        self.u32_struct = struct.Struct(f'{self.endian}I')
 
+        # I/O counters, for profiling
+        self.seek_count = 0
+        self.read_count = 0
+        self.bytes_read = 0
 
-    def search(self, target: bytes, start_addr: int, end_addr: int) -> int:
+
+    def close(self):
         """
-        Search for a piece of data in memory, efficiently.
-        Return None if not found.
+        Release any resources (other than the file itself) held by this
+        source. The default implementation does nothing.
+        """
+        pass
+
+
+    def get_mapped_ranges(self, start_addr: int, end_addr: int) -> list:
+        """
+        Return a sorted list of (start, end) address ranges covering the
+        readable parts of [start_addr, end_addr), with adjacent ranges
+        merged. The default implementation assumes everything is
+        readable.
+        """
+        return [(start_addr, end_addr)]
+
+
+    def iter_search(self, targets: list, ranges: list, *, block_size: int = 0x10000):
+        """
+        Search for several pieces of data at once, in a single pass over
+        each of the (start, end) address ranges given. Yield
+        (address, target) for every match that starts within a range.
+        Matches for any one target are yielded in increasing address
+        order.
+        Unmapped memory is skipped over rather than read, and matches
+        can't span it.
         No guarantees about where the file will be seeked to afterward.
         """
+        # Consecutive blocks only need to overlap enough for the longest
+        # target to fit across the boundary
+        overlap = max(len(t) for t in targets) - 1
+
+        for range_start, range_end in ranges:
+            for run_start, run_end in self.get_mapped_ranges(range_start, range_end + overlap):
+                carry = b''
+                addr = run_start
+
+                while addr < run_end:
+                    amount = min(block_size, run_end - addr)
+                    new_data = self.read_from(addr, amount)
+                    data = carry + new_data
+                    data_addr = addr - len(carry)
+
+                    matches = []
+                    for target in targets:
+                        idx = data.find(target)
+                        while idx != -1:
+                            match_addr = data_addr + idx
+                            if match_addr >= range_end:
+                                break
+                            # Skip matches entirely within the carried-over
+                            # part (they were found in the previous block)
+                            if idx + len(target) > len(carry):
+                                matches.append((match_addr, target))
+                            idx = data.find(target, idx + 1)
+
+                    matches.sort()
+                    yield from matches
+
+                    if len(new_data) < amount:
+                        break
+
+                    carry = data[len(data) - overlap:] if overlap else b''
+                    addr += amount
+
+
+    def iter_word_pattern(self, pattern: WordPattern, start_addr: int, end_addr: int):
+        """
+        Iterate over all 4-aligned addresses in [start_addr, end_addr)
+        at which a WordPattern matches, in increasing order. Each mapped
+        part of the range is read and scanned in one go.
+        """
+        pattern_size = len(pattern) * 4
 
-        # Larger block sizes are faster but also use more RAM.
-        # Also needs to be much greater than len(target).
-        block_size = max(0x8000, len(target) * 3)
-        inc_size = block_size // 2  # this is so we don't miss the target if
-                                    # it's between two blocks
+        for run_start, run_end in self.get_mapped_ranges(start_addr, end_addr + pattern_size - 4):
+            with self.read_view_from(run_start, run_end - run_start) as data:
+                offsets = pattern.find_all(data, self.endian)
 
-        for addr in range(start_addr, end_addr, inc_size):
-            self.seek(addr)
+            for offs in offsets:
+                if run_start + offs >= end_addr:
+                    break
+                yield run_start + offs
 
-            idx = self.read(block_size).find(target)
-            if idx != -1:
-                return addr + idx
+
+    def search(self, target: bytes, start_addr: int, end_addr: int) -> int:
+        """
+        Search for a piece of data in memory, efficiently.
+        Return None if not found.
+        No guarantees about where the file will be seeked to afterward.
+        """
+        for addr, _ in self.iter_search([target], [(start_addr, end_addr)]):
+            return addr
 
         # :(
         return None
@@ -71,14 +291,42 @@ class Source:
         """
         Like file.read()
         """
-        return self.file.read(amount)
+        data = self.file.read(amount)
+        self.read_count += 1
+        self.bytes_read += len(data)
+        return data
+
+
+    def get_bytes_decompressed(self) -> int:
+        """
+        Return the total number of bytes decompressed so far. The
+        default implementation returns 0, for uncompressed sources.
+        """
+        return 0
+
+
+    def get_section_lookup_counts(self) -> tuple:
+        """
+        Return (lookups, fast_hits, linear_scans) counts of
+        address-to-section lookups so far. The default implementation
+        returns zeros, for sources without sections.
+        """
+        return (0, 0, 0)
+
+
+    def read_view(self, amount: int) -> memoryview:
+        """
+        Like read(), but return a memoryview. Subclasses that can do so
+        return a view of their underlying buffer instead of a copy.
+        """
+        return memoryview(self.read(amount))
 
 
     def read_u32(self) -> int:
         """
         Convenience function to read a u32.
         """
-        return struct.unpack(f'{self.endian}I', self.read(4))[0]
+        return self.u32_struct.unpack(self.read(4))[0]
 
 
     def read_u32_from(self, addr: int) -> int:
@@ -89,14 +337,233 @@ class Source:
         return self.read_u32()
 
 
+    def read_from(self, addr: int, amount: int) -> bytes:
+        """
+        Read up to `amount` bytes starting at a given address. Like
+        file.read(), the result may be shorter than requested if the end
+        of readable memory is reached.
+        """
+        self.seek(addr)
+        return self.read(amount)
+
+
+    def read_view_from(self, addr: int, amount: int) -> memoryview:
+        """
+        Like read_from(), but return a memoryview. Subclasses that can
+        do so return a view of their underlying buffer instead of a
+        copy; release it when done with it (e.g. with a "with"
+        statement), so that the source can be closed.
+        """
+        return memoryview(self.read_from(addr, amount))
+
+
+    def read_u32_array(self, addr: int, count: int) -> array.array:
+        """
+        Read `count` u32s starting at a given address, in one read.
+        Raise ValueError if they're not all readable.
+        """
+        with self.read_view_from(addr, count * 4) as data:
+            if len(data) < count * 4:
+                raise ValueError(f"Couldn't read {count} u32s from {addr:08x}")
+            return decode_u32_array(data, self.endian)
+
+
+    def iter_u32(self, addr: int, count: int = None, *, block_count: int = 0x400):
+        """
+        Iterate over u32s starting at a given address, reading
+        block_count of them at a time. Stop after `count` values (if not
+        None), or at the end of readable memory.
+        """
+        while count is None or count > 0:
+            # Readable memory can end exactly on a block boundary, and
+            # some sources raise on reads that start in unmapped memory
+            if not self.get_mapped_ranges(addr, addr + 4):
+                return
+
+            this_count = block_count if count is None else min(count, block_count)
+
+            with self.read_view_from(addr, this_count * 4) as data:
+                num_readable = len(data) // 4
+                values = decode_u32_array(data[:num_readable * 4], self.endian)
+            yield from values
+
+            if num_readable < this_count:
+                return
+
+            addr += this_count * 4
+            if count is not None:
+                count -= this_count
+
+
+@dataclasses.dataclass
+class SourceFormat:
+    """
+    A cheap check for recognizing a file format, and the Source subclass
+    to use for files that pass it. `matches` is called with the first
+    few bytes of the file (see export.HEADER_PROBE_SIZE) and the file's
+    total size.
+    """
+    source_class: type
+    matches: typing.Callable[[bytes, int], bool]
+
+
 class SimpleRAMDumpSource(Source):
     """
-    Basic source that just interprets the file as a RAM dump from some base address
+    Basic source that just interprets the file as a RAM dump from some base address.
+
+    If possible, the file is memory-mapped, and reads, searches and u32
+    decoding all work directly on the mapping (so the OS page cache is
+    the only buffer). Otherwise, this falls back to regular file I/O.
     """
     base_address: int
 
+    def __init__(self, file, *, use_mmap: bool = True):
+        super().__init__(file)
+
+        self.mapping = None
+        self.view = None
+        self.cursor = 0
+
+        if use_mmap:
+            try:
+                self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # Not a real file, or an empty one, or a platform that
+                # doesn't support mmap -- just use regular reads instead
+                self.mapping = None
+
+        if self.mapping is not None:
+            self.view = memoryview(self.mapping)
+
+
+    def close(self):
+        """
+        Release the memory mapping, if there is one
+        """
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+    def get_size(self) -> int:
+        """
+        Return the size of the RAM dump, in bytes
+        """
+        if self.mapping is not None:
+            return len(self.mapping)
+        return os.fstat(self.file.fileno()).st_size
+
+
+    def get_mapped_ranges(self, start_addr: int, end_addr: int) -> list:
+        """
+        Return a sorted list of (start, end) address ranges covering the
+        readable parts of [start_addr, end_addr)
+        """
+        start_addr = max(start_addr, self.base_address)
+        end_addr = min(end_addr, self.base_address + self.get_size())
+        if start_addr >= end_addr:
+            return []
+        return [(start_addr, end_addr)]
+
+
+    def iter_search(self, targets: list, ranges: list, *, block_size: int = 0x10000):
+        """
+        Search for several pieces of data at once. Yield
+        (address, target) for every match that starts within one of the
+        (start, end) address ranges, in increasing address order within
+        each range.
+        """
+        if self.mapping is None:
+            yield from super().iter_search(targets, ranges, block_size=block_size)
+            return
+
+        def iter_target_matches(target: bytes, start: int, end: int):
+            """
+            Iterate over (address, target) for matches of one target,
+            straight from the mapping
+            """
+            idx = self.mapping.find(target, start, end + len(target) - 1)
+            while idx != -1 and idx < end:
+                yield self.base_address + idx, target
+                idx = self.mapping.find(target, idx + 1, end + len(target) - 1)
+
+        for range_start, range_end in ranges:
+            for run_start, run_end in self.get_mapped_ranges(range_start, range_end):
+                start = run_start - self.base_address
+                end = run_end - self.base_address
+                self.read_count += 1
+                self.bytes_read += end - start
+                yield from heapq.merge(*(iter_target_matches(t, start, end) for t in targets))
+
+
     def seek(self, addr: int):
-        self.file.seek(addr - self.base_address)
+        """
+        Seek to a specific RAM address
+        """
+        self.seek_count += 1
+
+        if self.mapping is None:
+            self.file.seek(addr - self.base_address)
+        else:
+            offset = addr - self.base_address
+            if not 0 <= offset <= len(self.mapping):
+                raise ValueError(f'{addr:08x} is not in the RAM dump')
+            self.cursor = offset
+
+
+    def read(self, amount: int) -> bytes:
+        """
+        Like file.read()
+        """
+        if self.mapping is None:
+            return super().read(amount)
+
+        data = self.mapping[self.cursor : self.cursor + amount]
+        self.cursor += len(data)
+        self.read_count += 1
+        self.bytes_read += len(data)
+        return data
+
+
+    def read_view(self, amount: int) -> memoryview:
+        """
+        Like read(), but return a memoryview into the mapping instead of
+        a copy, if possible
+        """
+        if self.mapping is None:
+            return super().read_view(amount)
+
+        view = self.view[self.cursor : self.cursor + amount]
+        self.cursor += len(view)
+        self.read_count += 1
+        self.bytes_read += len(view)
+        return view
+
+
+    def read_view_from(self, addr: int, amount: int) -> memoryview:
+        """
+        Like read_from(), but return a memoryview into the mapping
+        instead of a copy, if possible
+        """
+        self.seek(addr)
+        return self.read_view(amount)
+
+
+    def read_u32(self) -> int:
+        """
+        Convenience function to read a u32.
+        """
+        if self.mapping is None:
+            return super().read_u32()
+
+        value, = self.u32_struct.unpack_from(self.view, self.cursor)
+        self.cursor += 4
+        self.read_count += 1
+        self.bytes_read += 4
+        return value
 
 
 class SectionedFileSource_AbstractSection:
@@ -160,6 +627,9 @@ class SectionedFileSource_CompressedSection(SectionedFileSource_AbstractSection)
         self.decomp_data = None
         self.cursor = 0
 
+        self.bytes_decompressed = 0
+        self.cache_key = None
+
 
     def decompress(self, data: bytes) -> bytes:
         """
@@ -169,14 +639,83 @@ class SectionedFileSource_CompressedSection(SectionedFileSource_AbstractSection)
         raise NotImplementedError
 
 
-    def ensure_decompressed(self):
+    def ensure_decompressed(self, end: int = None):
         """
         If the data hasn't been decompressed yet, decompress it.
         Otherwise do nothing.
+        `end` is the offset (relative to the start of the section) up to
+        which data is actually needed. Subclasses that can decompress
+        incrementally may use it to stop early; this implementation
+        ignores it and always decompresses everything.
         """
         if self.decomp_data is not None: return
+        if self.load_from_cache(): return
+
         self.file.seek(self.offset)
         self.decomp_data = self.decompress(self.file.read(self.comp_size))
+        self.bytes_decompressed = len(self.decomp_data)
+
+        self.save_to_cache()
+
+
+    def get_cache_key(self) -> str:
+        """
+        Return the key for this section in decompressed_section_cache:
+        a hash of the compressed payload, plus the decompressed size and
+        the class name (standing in for the compression algorithm)
+        """
+        if self.cache_key is None:
+            digest = cache.hash_file_range(self.file, self.offset, self.comp_size)
+            self.cache_key = f'{digest}-{self.decomp_size:x}-{type(self).__name__}'
+        return self.cache_key
+
+
+    def load_from_cache(self) -> bool:
+        """
+        Try to load the decompressed data (as a memory mapping) from
+        decompressed_section_cache. Return True if successful.
+        """
+        if decompressed_section_cache is None:
+            return False
+
+        mapping = decompressed_section_cache.get_mmap(self.get_cache_key())
+        if mapping is None:
+            return False
+        if len(mapping) != self.decomp_size:
+            mapping.close()
+            return False
+
+        self.decomp_data = mapping
+        return True
+
+
+    def save_to_cache(self):
+        """
+        Save the decompressed data to decompressed_section_cache, if it's
+        enabled and the section has been fully decompressed
+        """
+        if decompressed_section_cache is None: return
+        if self.decomp_data is None or len(self.decomp_data) != self.decomp_size: return
+
+        decompressed_section_cache.put(self.get_cache_key(), self.decomp_data)
+
+
+    def close(self):
+        """
+        Release the decompressed data (closing the memory mapping, if
+        it was loaded from the cache)
+        """
+        if isinstance(self.decomp_data, mmap.mmap):
+            self.decomp_data.close()
+        self.decomp_data = None
+
+
+    def get_bytes_decompressed(self) -> int:
+        """
+        Return the number of bytes that have actually been decompressed
+        so far (not counting data loaded from the cache)
+        """
+        return self.bytes_decompressed
 
 
     def seek(self, addr: int):
@@ -190,8 +729,8 @@ class SectionedFileSource_CompressedSection(SectionedFileSource_AbstractSection)
         """
         Like file.read()
         """
-        self.ensure_decompressed()
-        data = self.decomp_data[self.cursor : self.cursor + amount]
+        self.ensure_decompressed(self.cursor + amount)
+        data = bytes(self.decomp_data[self.cursor : self.cursor + amount])
         self.cursor += amount
         return data
 
@@ -211,20 +750,100 @@ class SectionedFileSource(Source):
         # So .read() can know which section was most recently .seek()ed in
         self.current_section = None
 
+        # Sorted interval index over self.sections (see
+        # build_section_index())
+        self.section_starts = None
+        self.sorted_sections = None
+        self.sections_overlap = False
+
+        # Lookup counters, for profiling
+        self.section_lookups = 0
+        self.section_lookup_fast_hits = 0
+        self.section_lookup_linear_scans = 0
+
+
+    def build_section_index(self):
+        """
+        Build the sorted interval index used by get_section(). Subclasses
+        should call this once they've finished filling in self.sections.
+        """
+        nonempty = [s for s in self.sections if s.decomp_size > 0]
+        self.sorted_sections = sorted(nonempty, key=lambda s: (s.addr, s.decomp_size))
+        self.section_starts = [s.addr for s in self.sorted_sections]
+
+        # If any sections overlap, the section that comes first in
+        # self.sections wins, which bisection can't tell
+        self.sections_overlap = any(
+            a.addr + a.decomp_size > b.addr
+            for a, b in zip(self.sorted_sections, self.sorted_sections[1:]))
+
+
+    def get_mapped_ranges(self, start_addr: int, end_addr: int) -> list:
+        """
+        Return a sorted list of (start, end) address ranges covering the
+        parts of [start_addr, end_addr) that are in sections, with
+        adjacent sections merged
+        """
+        if self.section_starts is None:
+            self.build_section_index()
+
+        ranges = []
+        for section in self.sorted_sections:
+            start = max(start_addr, section.addr)
+            end = min(end_addr, section.addr + section.decomp_size)
+            if start >= end:
+                continue
+
+            if ranges and ranges[-1][1] >= start:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+
+        return ranges
+
 
     def get_section(self, addr: int) -> SectionedFileSource_AbstractSection:
         """
         Get the section containing the specified address (or None if none)
         """
+        self.section_lookups += 1
+
+        if self.section_starts is None:
+            self.build_section_index()
+
+        if not self.sections_overlap:
+            # Fast path: same section as last time
+            if self.current_section is not None and self.current_section.has(addr):
+                self.section_lookup_fast_hits += 1
+                return self.current_section
+
+            i = bisect.bisect_right(self.section_starts, addr) - 1
+            if i >= 0:
+                section = self.sorted_sections[i]
+                if section.has(addr):
+                    return section
+
+        # The address isn't in any section, or sections overlap: fall
+        # back to a linear scan, which finds the first matching section
+        self.section_lookup_linear_scans += 1
         for section in self.sections:
             if section.has(addr):
                 return section
 
 
+    def get_section_lookup_counts(self) -> tuple:
+        """
+        Return (lookups, fast_hits, linear_scans) section-lookup counts
+        """
+        return (self.section_lookups, self.section_lookup_fast_hits, self.section_lookup_linear_scans)
+
+
     def seek(self, addr: int):
         """
         Seek to a specific RAM address
         """
+        self.seek_count += 1
+
         self.current_section = self.get_section(addr)
         if self.current_section is None:
             raise ValueError(f'{addr:08x} is not in any section')
@@ -236,7 +855,132 @@ class SectionedFileSource(Source):
         """
         Like file.read()
         """
-        return self.current_section.read(amount)
+        data = self.current_section.read(amount)
+        self.read_count += 1
+        self.bytes_read += len(data)
+        return data
+
+
+    def read_from(self, addr: int, amount: int) -> bytes:
+        """
+        Read up to `amount` bytes starting at a given address,
+        continuing into the next section if the read crosses a section
+        boundary. Stop early at the end of a section followed by
+        unmapped memory.
+        """
+        self.seek_count += 1
+        chunks = []
+
+        while amount > 0:
+            section = self.get_section(addr)
+            if section is None:
+                if not chunks:
+                    raise ValueError(f'{addr:08x} is not in any section')
+                break
+
+            self.current_section = section
+            this_amount = min(amount, section.addr + section.decomp_size - addr)
+
+            section.seek(addr)
+            chunk = section.read(this_amount)
+            chunks.append(chunk)
+            self.read_count += 1
+            self.bytes_read += len(chunk)
+            if len(chunk) < this_amount:
+                break
+
+            addr += this_amount
+            amount -= this_amount
+
+        return b''.join(chunks)
+
+
+    def close(self):
+        """
+        Release the decompressed data of any compressed sections
+        """
+        for section in self.sections:
+            if isinstance(section, SectionedFileSource_CompressedSection):
+                section.close()
+
+
+    def get_bytes_decompressed(self) -> int:
+        """
+        Return the total number of bytes decompressed so far, across all
+        compressed sections
+        """
+        return sum(section.get_bytes_decompressed()
+            for section in self.sections
+            if isinstance(section, SectionedFileSource_CompressedSection))
+
+
+class MemoryOverrides(dict):
+    """
+    A dict of {address: value} memory overrides, which also keeps a
+    sorted list of its addresses for bulk reads. The list is rebuilt on
+    first use after any change.
+    """
+    __slots__ = ('sorted_addrs',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sorted_addrs = None
+
+
+    def get_sorted_addrs(self) -> list:
+        """
+        Return a sorted list of the addresses
+        """
+        if self.sorted_addrs is None:
+            self.sorted_addrs = sorted(self)
+        return self.sorted_addrs
+
+
+    def invalidate(self):
+        """
+        Forget the sorted list of addresses, after a change
+        """
+        self.sorted_addrs = None
+
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.invalidate()
+
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate()
+
+
+    def __ior__(self, other):
+        self.invalidate()
+        return super().__ior__(other)
+
+
+    def clear(self):
+        self.invalidate()
+        super().clear()
+
+
+    def pop(self, *args):
+        self.invalidate()
+        return super().pop(*args)
+
+
+    def popitem(self):
+        self.invalidate()
+        return super().popitem()
+
+
+    def setdefault(self, key, default=None):
+        self.invalidate()
+        return super().setdefault(key, default)
+
+
+    def update(self, *args, **kwargs):
+        self.invalidate()
+        super().update(*args, **kwargs)
 
 
 class Analysis:
@@ -247,20 +991,57 @@ class Analysis:
     uses_priorities: bool = False
     uses_static_init_func: bool = False
 
+    # Game, and IDs of the variants within it, whose address hints (from
+    # the data jsons) are worth checking for this kind of source. None
+    # means all variants of the game.
+    hints_game: common.Game = None
+    hints_variant_ids: tuple = None
+
+    # (start, end) address range that find_table_addr() searches in (if
+    # address hints don't pan out). Can be overridden per instance, e.g.
+    # widened for unknown builds.
+    table_search_range: tuple = None
+
     source: Source
 
     static_init_func_addr: int
-    memory_overrides: dict
+    interpreter_stats: dict = None
     table_addr: int
     table_length: int
     terminator_command: int
     game_variant: game_variants.GameVariant
 
 
-    def __init__(self, source):
+    def __init__(self, source, *, table_search_range: tuple = None):
         self.source = source
         self.memory_overrides = {}
 
+        if table_search_range is not None:
+            start, end = table_search_range
+            if start >= end:
+                raise ValueError(f'Invalid table search range: {start:08x}-{end:08x}')
+            self.table_search_range = (start, end)
+
+        # Optional profiling.Profiler, to record the cost of each phase
+        self.profiler = None
+
+
+    @property
+    def memory_overrides(self) -> MemoryOverrides:
+        """
+        {address: value} overrides for the commands lists data (see
+        read_commands_u32_from()). Any dict can be assigned; it's
+        copied to a MemoryOverrides.
+        """
+        return self._memory_overrides
+
+
+    @memory_overrides.setter
+    def memory_overrides(self, value: dict):
+        if not isinstance(value, MemoryOverrides):
+            value = MemoryOverrides(value)
+        self._memory_overrides = value
+
 
     def read_commands_u32_from(self, addr: int) -> int:
         """
@@ -274,6 +1055,85 @@ class Analysis:
             return self.source.read_u32_from(addr)
 
 
+    def read_commands_u32_prefix(self, addr: int, count: int) -> list:
+        """
+        Bulk version of read_commands_u32_from(): read up to `count` u32s
+        starting at addr, with self.memory_overrides applied on top.
+        Stop early at the first u32 that can't be read from either.
+        (Values from memory_overrides are used as-is, so they may be
+        outside of the u32 range.)
+        """
+        end_addr = addr + count * 4
+
+        try:
+            data = self.source.read_view_from(addr, count * 4)
+        except ValueError:
+            data = memoryview(b'')
+        with data:
+            num_readable = len(data) // 4
+            values = decode_u32_array(data[:num_readable * 4], self.source.endian).tolist()
+        values.extend([0] * (count - num_readable))
+
+        # Overlay the memory overrides
+        override_addrs = self.memory_overrides.get_sorted_addrs()
+        i = bisect.bisect_left(override_addrs, addr)
+        while i < len(override_addrs) and override_addrs[i] < end_addr:
+            o_addr = override_addrs[i]
+            if (o_addr - addr) % 4 == 0:
+                values[(o_addr - addr) // 4] = self.memory_overrides[o_addr]
+            i += 1
+
+        # Overrides can continue past the end of readable memory
+        length = num_readable
+        while length < count and addr + length * 4 in self.memory_overrides:
+            length += 1
+
+        del values[length:]
+        return values
+
+
+    def iter_address_hints(self, key: str):
+        """
+        Iterate over the known addresses of `key` (e.g. "scripts_table")
+        across all relevant builds, without duplicates
+        """
+        if self.hints_game is None:
+            return
+
+        seen = set()
+        for id, variant in game_variants.load_game_json(self.hints_game).items():
+            if self.hints_variant_ids is not None and id not in self.hints_variant_ids:
+                continue
+            for hints in variant.address_hints:
+                addr = hints.addresses.get(key)
+                if addr is not None and addr not in seen:
+                    seen.add(addr)
+                    yield addr
+
+
+    def check_address_hints(self, key: str, check) -> int:
+        """
+        Return the first known address of `key` for which check(addr)
+        returns True, or None if there isn't one. Addresses that can't
+        be read from count as failing the check.
+        """
+        for addr in self.iter_address_hints(key):
+            try:
+                if check(addr):
+                    return addr
+            except (ValueError, struct.error):
+                pass
+
+
+    def phase(self, name: str):
+        """
+        Context manager marking a phase of analysis, for profiling
+        """
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+
     def analyze(self, *, verbose=True):
         """
         Call all the analysis functions
@@ -284,18 +1144,24 @@ class Analysis:
 
         if self.uses_static_init_func:
             # Find the static init func
-            self.static_init_func_addr = self.find_static_init_func()
+            with self.phase('static init search'):
+                self.static_init_func_addr = self.find_static_init_func()
             if self.static_init_func_addr is None:
                 raise ValueError("Couldn't find static init function")
             vprint(f'Static init function: {self.static_init_func_addr:08x}')
 
             # Interpret it if needed, to populate self.memory_overrides
             if self.source.needs_interpreter:
-                self.memory_overrides = self.run_interpreter()
+                with self.phase('interpreter'):
+                    self.memory_overrides = self.run_interpreter()
                 vprint(f'Interpreter created {len(self.memory_overrides)} memory overrides')
+                if self.interpreter_stats is not None:
+                    vprint(f'Interpreter ran {self.interpreter_stats["instructions_executed"]} instructions'
+                        f' in {self.interpreter_stats["time_spent"]:.3f}s')
 
         # Find basic info about the main table
-        self.table_addr = self.find_table_addr()
+        with self.phase('table address'):
+            self.table_addr = self.find_table_addr()
         if self.table_addr is None:
             raise ValueError("Couldn't find scripts table")
         vprint(f'Scripts table: {self.table_addr:08x}')
@@ -305,12 +1171,14 @@ class Analysis:
             first_script_addr = self.source.read_u32()
             vprint(f'First script: {first_script_addr:08x}')
 
-        self.table_length = self.find_table_length()
+        with self.phase('table length'):
+            self.table_length = self.find_table_length()
         if self.table_length is None:
             raise ValueError("Couldn't determine scripts table length")
         vprint(f'Scripts table length: {self.table_length}')
 
-        self.terminator_command = self.find_terminator_command_id()
+        with self.phase('terminator'):
+            self.terminator_command = self.find_terminator_command_id()
         if self.terminator_command is None:
             raise ValueError("Couldn't determine script terminator command")
         vprint(f'Terminator command: {self.terminator_command}')
@@ -319,7 +1187,8 @@ class Analysis:
         ...
 
         # Finally, classify the game variant we're looking at
-        self.game_variant = self.detect_game_variant()
+        with self.phase('variant detection'):
+            self.game_variant = self.detect_game_variant()
         if self.game_variant is None:
             raise ValueError("Couldn't determine game variant")
         vprint(f'Game variant: {self.game_variant.name}')
@@ -362,14 +1231,19 @@ class Analysis:
         # This strategy works for all of the games.
         CHANGE_THRESHOLD = 0x10000
 
+        entry_words = 2 if self.uses_priorities else 1
+
         prev_ptr_in_table = None
-        self.source.seek(self.table_addr)
+        table_words = self.source.iter_u32(self.table_addr, 999 * entry_words)
 
         for i in range(999):
             # Read table entry
-            if self.uses_priorities:
-                self.source.read_u32()  # skip past this
-            this_ptr_in_table = self.source.read_u32()
+            try:
+                if self.uses_priorities:
+                    next(table_words)  # skip past this
+                this_ptr_in_table = next(table_words)
+            except StopIteration:
+                return None
 
             # If it's more than CHANGE_THRESHOLD away from the previous,
             # we're done
@@ -435,3 +1309,35 @@ class Analysis:
             info['static_init_func_addr'] = self.static_init_func_addr
 
         return info
+
+
+    def load_json(self, info: dict):
+        """
+        Fill in the analysis results from a dict previously returned by
+        to_json(), instead of running analyze()
+        """
+        variants = game_variants.load_game_json(common.Game(info['game']))
+        self.game_variant = variants[info['game_variant']]
+
+        self.table_addr = info['table_addr']
+        self.table_length = info['table_length']
+        self.terminator_command = info['terminator_command']
+
+        if self.uses_static_init_func:
+            self.static_init_func_addr = info['static_init_func_addr']
+
+
+    def print_summary(self):
+        """
+        Print the analysis results, in the same format analyze() uses in
+        verbose mode
+        """
+        if self.uses_static_init_func:
+            print(f'Static init function: {self.static_init_func_addr:08x}')
+            if self.source.needs_interpreter:
+                print(f'Interpreter created {len(self.memory_overrides)} memory overrides')
+
+        print(f'Scripts table: {self.table_addr:08x}')
+        print(f'Scripts table length: {self.table_length}')
+        print(f'Terminator command: {self.terminator_command}')
+        print(f'Game variant: {self.game_variant.name}')
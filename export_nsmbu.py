@@ -15,9 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
-import contextlib
-import pathlib
 import struct
+import time
 import zlib
 
 import common
@@ -29,86 +28,113 @@ import game_variants
 class TheWorldsWorstPowerPCInterpreter:
     """
     An extremely minimal PPC interpreter that only implements the bare
-    minimum instructions required to reconstruct the command lists
+    minimum instructions required to reconstruct the command lists.
+    Functions are read in bulk and pre-decoded before being run, and
+    instructions are dispatched through a table by primary opcode.
     """
+    BLR = 0x4E800020
+    MAX_FUNCTION_LENGTH = 9999  # instructions
+
     def __init__(self, source):
         self.source = source
         self.registers = [0] * 32
         self.memory = {}
 
-    def run_function_at(self, addr: int):
-        """
-        Run the function at addr up to the blr
-        """
-        for i in range(9999):
-            inst = self.source.read_u32_from(addr)
-
-            if inst == 0x4E800020:  # blr
-                return
-
-            self.run_inst(inst)
-
-            addr += 4
-
-        else:
-            print("WARNING: function didn't end")
-
-    def run_inst(self, inst: int):
+        # Stats
+        self.instructions_executed = 0
+        self.time_spent = 0.0
+
+        self.dispatch = {
+            14: self.run_addi,
+            15: self.run_addis,
+            31: self.run_opcode_31,
+            32: self.run_lwz,
+            36: self.run_stw,
+            37: self.run_stwu,
+            46: self.run_nop,  # lmw
+            47: self.run_nop,  # stmw
+            48: self.run_nop,  # lfs
+            52: self.run_nop,  # stfs
+        }
+
+    @staticmethod
+    def decode(inst: int) -> tuple:
         """
-        Run one instruction with the value given
+        Decode an instruction to a tuple of
+        (opcode, s, a, b, d, opcode2)
+        (not all of which are meaningful for every instruction)
         """
-        # Decode
         opcode = inst >> 26
         s = (inst >> 21) & 0x1f
         a = (inst >> 16) & 0x1f
+        b = (inst >> 11) & 0x1f
         d = inst & 0xffff
         if d & 0x8000:
             d = d - 0x10000
+        opcode2 = (inst >> 1) & 0x3ff
+        return (opcode, s, a, b, d, opcode2)
 
-        if opcode == 14:  # addi
-            b = 0 if a == 0 else self.registers[a]
-            self.registers[s] = b + d
+    def fetch_function(self, addr: int) -> (list, bool):
+        """
+        Read the function at addr in bulk, up to the blr, and return a
+        list of its pre-decoded instructions, and whether the blr was
+        found
+        """
+        decoded = []
+        for inst in self.source.iter_u32(addr, self.MAX_FUNCTION_LENGTH, block_count=0x1000):
+            if inst == self.BLR:
+                return decoded, True
+            decoded.append(self.decode(inst))
 
-        elif opcode == 15:  # addis
-            b = 0 if a == 0 else self.registers[a]
-            self.registers[s] = b + (d << 16)
+        return decoded, False
 
-        elif opcode == 31:  # (various, depends on opcode2)
-            opcode2 = (inst >> 1) & 0x3ff
+    def run_function_at(self, addr: int):
+        """
+        Run the function at addr up to the blr
+        """
+        start_time = time.perf_counter()
 
-            if opcode2 == 444:  # or (used because mr is a pseudoinst of it)
-                b = (inst >> 11) & 0x1f
-                self.registers[a] = self.registers[s] | self.registers[b]
+        decoded, found_end = self.fetch_function(addr)
 
+        dispatch = self.dispatch
+        for opcode, s, a, b, d, opcode2 in decoded:
+            handler = dispatch.get(opcode)
+            if handler is None:
+                print(f'WARNING: unexpected opcode {opcode}')
             else:
-                print(f'WARNING: unexpected opcode 31.{opcode2}')
+                handler(s, a, b, d, opcode2)
 
-        elif opcode == 32:  # lwz
-            b = 0 if a == 0 else self.registers[a]
-            self.registers[s] = self.memory.get(b + d)
+        self.instructions_executed += len(decoded)
+        self.time_spent += time.perf_counter() - start_time
+
+        if not found_end:
+            print("WARNING: function didn't end")
 
-        elif opcode == 36:  # stw
-            self.memory[self.registers[a] + d] = self.registers[s]
+    def run_addi(self, s, a, b, d, opcode2):
+        self.registers[s] = (0 if a == 0 else self.registers[a]) + d
 
-        elif opcode == 37:  # stwu
-            ea = self.registers[a] + d
-            self.memory[ea] = self.registers[s]
-            self.registers[a] = ea
+    def run_addis(self, s, a, b, d, opcode2):
+        self.registers[s] = (0 if a == 0 else self.registers[a]) + (d << 16)
 
-        elif opcode == 46:  # lmw
-            pass  # Not required
+    def run_opcode_31(self, s, a, b, d, opcode2):
+        if opcode2 == 444:  # or (used because mr is a pseudoinst of it)
+            self.registers[a] = self.registers[s] | self.registers[b]
+        else:
+            print(f'WARNING: unexpected opcode 31.{opcode2}')
 
-        elif opcode == 47:  # stmw
-            pass  # Not required
+    def run_lwz(self, s, a, b, d, opcode2):
+        self.registers[s] = self.memory.get((0 if a == 0 else self.registers[a]) + d)
 
-        elif opcode == 48:  # lfs
-            pass  # Not required
+    def run_stw(self, s, a, b, d, opcode2):
+        self.memory[self.registers[a] + d] = self.registers[s]
 
-        elif opcode == 52:  # stfs
-            pass  # Not required
+    def run_stwu(self, s, a, b, d, opcode2):
+        ea = self.registers[a] + d
+        self.memory[ea] = self.registers[s]
+        self.registers[a] = ea
 
-        else:
-            print(f'WARNING: unexpected opcode {opcode}')
+    def run_nop(self, s, a, b, d, opcode2):
+        pass  # Not required
 
 
 class RPXSectionUncompressed(export_base.SectionedFileSource_UncompressedSection):
@@ -120,12 +146,80 @@ class RPXSectionUncompressed(export_base.SectionedFileSource_UncompressedSection
 
 class RPXSectionCompressed(export_base.SectionedFileSource_CompressedSection):
     """
-    Compressed RPX section
+    Compressed RPX section.
+    This is inflated incrementally, only as far as the highest offset
+    that's been read so far. The decompressor object and the position in
+    the compressed data act as a checkpoint, so reading further into the
+    section later resumes from there instead of starting over.
     """
+    # Inflate in steps of at least this many bytes, so that sequential
+    # reads don't each cause a tiny decompress() call
+    INFLATE_STEP = 0x10000
+
+    # Amount of compressed data to read from the file at a time
+    COMP_READ_SIZE = 0x10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decompressor = zlib.decompressobj()
+        self.comp_pos = 0  # how much compressed data has been consumed
+
+
     def decompress(self, data: bytes) -> bytes:
         return zlib.decompress(data)
 
 
+    def ensure_decompressed(self, end: int = None):
+        """
+        Inflate the section at least up to offset `end` (or all of it,
+        if None, or if it has to be saved to the section cache)
+        """
+        if self.decomp_data is None:
+            if self.load_from_cache(): return
+            self.decomp_data = bytearray()
+
+            # On a cache miss, inflate everything so that the section
+            # can be saved, and later runs can skip inflating it
+            if export_base.decompressed_section_cache is not None:
+                end = None
+
+        if end is None:
+            end = self.decomp_size
+        elif end <= len(self.decomp_data):
+            return
+        else:
+            end = min(max(end, len(self.decomp_data) + self.INFLATE_STEP), self.decomp_size)
+
+        while len(self.decomp_data) < end and not self.decompressor.eof:
+            comp_data = self.decompressor.unconsumed_tail
+            if not comp_data:
+                if self.comp_pos >= self.comp_size:
+                    break
+                self.file.seek(self.offset + self.comp_pos)
+                comp_data = self.file.read(min(self.COMP_READ_SIZE, self.comp_size - self.comp_pos))
+                if not comp_data:
+                    break
+                self.comp_pos += len(comp_data)
+
+            new_data = self.decompressor.decompress(
+                comp_data, end - len(self.decomp_data))
+            self.decomp_data += new_data
+            self.bytes_decompressed += len(new_data)
+
+            if len(self.decomp_data) == self.decomp_size:
+                self.save_to_cache()
+
+
+    def close(self):
+        """
+        Release the decompressed data, and reset the decompressor to
+        match
+        """
+        super().close()
+        self.decompressor = zlib.decompressobj()
+        self.comp_pos = 0
+
+
 class RPXFileSource(export_base.SectionedFileSource):
     """
     Source subclass for an RPX file
@@ -167,6 +261,8 @@ class RPXFileSource(export_base.SectionedFileSource):
             else:
                 self.sections.append(RPXSectionUncompressed(file, addr, offset, size))
 
+        self.build_section_index()
+
 
 class CemuRAMDumpSource(export_base.SimpleRAMDumpSource):
     """
@@ -178,38 +274,55 @@ class CemuRAMDumpSource(export_base.SimpleRAMDumpSource):
     base_address = 0x02000000
 
 
-@contextlib.contextmanager
-def try_open_source(path: pathlib.Path):
-    """
-    Context manager.
-    If the given Path can be recognized as a Source for this game, yield
-    that as the `with` target. Otherwise the `with` target will be None.
-    """
-    if path.is_dir():
-        main_ram_fp = (path / '02000000.bin')
-        if main_ram_fp.is_file():
-            with main_ram_fp.open('rb') as f:
-                yield CemuRAMDumpSource(f)
-                return
-
-    elif path.is_file():
-        size = path.stat().st_size
-
-        with path.open('rb') as f:
-
-            # Cemu RAM dump
-            if size == 0x4e000000:  # ~ 1.2 GB
-                yield CemuRAMDumpSource(f)
-                return
-
-            # RPX
-            # I'm aware this heuristic is very presumptuous
-            f.seek(0)
-            if f.read(4) == b'\x7fELF':
-                yield RPXFileSource(f)
-                return
-
-    yield None
+# Formats to check for, in order
+SOURCE_FORMATS = [
+    export_base.SourceFormat(CemuRAMDumpSource, lambda header, size: size == 0x4e000000),  # ~ 1.2 GB
+    # I'm aware this heuristic is very presumptuous
+    export_base.SourceFormat(RPXFileSource, lambda header, size: header.startswith(b'\x7fELF')),
+]
+
+# Folders containing a file with one of these names are RAM dumps
+FOLDER_SOURCES = {
+    '02000000.bin': CemuRAMDumpSource,
+}
+
+
+OPCODE_ADDI = export_base.ppc_instruction(14)
+OPCODE_LI = export_base.ppc_instruction(14, 0)   # addi with rA=0
+OPCODE_LIS = export_base.ppc_instruction(15, 0)  # addis with rA=0
+OPCODE_STW = export_base.ppc_instruction(36)
+OPCODE_STWU = export_base.ppc_instruction(37)
+OPCODE_STMW = export_base.ppc_instruction(47)
+OPCODE_LFS = export_base.ppc_instruction(48)
+OPCODE_STFS = export_base.ppc_instruction(52)
+
+STATIC_INIT_FUNC_PATTERN = export_base.WordPattern([
+    export_base.WordPattern.exact(0x4E800020),  # blr (end of the previous function)
+    OPCODE_STWU,  # 00
+    OPCODE_STMW,  # 04
+    OPCODE_LIS,   # 08
+    OPCODE_LIS,   # 0C
+    OPCODE_LI,    # 10
+    OPCODE_ADDI,  # 14
+    OPCODE_LI,    # 18
+    OPCODE_LIS,   # 1C
+    OPCODE_LFS,   # 20
+    OPCODE_LIS,   # 24
+    OPCODE_LI,    # 28
+    OPCODE_LIS,   # 2C
+    OPCODE_STFS,  # 30
+    OPCODE_ADDI,  # 34
+    OPCODE_STW,   # 38
+    OPCODE_ADDI,  # 3C
+])
+
+# An easily identified string a few hundred bytes before the start of
+# the scripts table
+TABLE_MARKER = b'TalkWindow_Sign_00'
+
+# Byte pattern that indicates the start of the scripts table (the first
+# script's priority, and the most-significant byte of its pointer)
+TABLE_START = bytes.fromhex('00 00 00 FF 10')
 
 
 class NSMBUAnalysis(export_base.Analysis):
@@ -219,82 +332,35 @@ class NSMBUAnalysis(export_base.Analysis):
     uses_priorities = True
     uses_static_init_func = True
 
+    hints_game = common.Game.NSMBU
+    hints_variant_ids = ('1.0.0', '1.1.0_1.2.0', '1.3.0_NSLU')
+
+    table_search_range = (0x10000000, 0x11000000)
+
+    def is_static_init_func(self, addr: int) -> bool:
+        """
+        Cheaply check if the static init function is at the given address
+        """
+        words = self.source.read_u32_array(addr - 4, len(STATIC_INIT_FUNC_PATTERN))
+        return STATIC_INIT_FUNC_PATTERN.matches(words)
+
+
     def find_static_init_func(self) -> int:
         """
         Auto-detect the static init function's address (e.g. 0x021DAB60 for NSMBU 1.0.0 US).
         Return None if not found.
         """
-        OPCODE_ADDI = 14
-        OPCODE_LI = (14, 0)   # addi with rA=0
-        OPCODE_LIS = (15, 0)  # addis with rA=0
-        OPCODE_STW = 36
-        OPCODE_STWU = 37
-        OPCODE_STMW = 47
-        OPCODE_LFS = 48
-        OPCODE_STFS = 52
-
-        BLR_BYTES = bytes.fromhex('4E 80 00 20')
-
-        STATIC_INIT_FUNC_START = [
-            OPCODE_STWU,  # 00
-            OPCODE_STMW,  # 04
-            OPCODE_LIS,   # 08
-            OPCODE_LIS,   # 0C
-            OPCODE_LI,    # 10
-            OPCODE_ADDI,  # 14
-            OPCODE_LI,    # 18
-            OPCODE_LIS,   # 1C
-            OPCODE_LFS,   # 20
-            OPCODE_LIS,   # 24
-            OPCODE_LI,    # 28
-            OPCODE_LIS,   # 2C
-            OPCODE_STFS,  # 30
-            OPCODE_ADDI,  # 34
-            OPCODE_STW,   # 38
-            OPCODE_ADDI,  # 3C
-        ]
-
-        def check_if_static_init_func(addr: int) -> bool:
-            """
-            Check if the function at addr matches the instruction
-            pattern of STATIC_INIT_FUNC_START
-            """
-            self.source.seek(addr)
-            instructions = struct.unpack_from('>16I', self.source.read(0x40))
-
-            for instruction, expected_opcode in zip(instructions, STATIC_INIT_FUNC_START):
-                expected_ra = None
-                if isinstance(expected_opcode, tuple):
-                    expected_opcode, expected_ra = expected_opcode
-
-                # Opcode: x >> 26
-                if instruction >> 26 != expected_opcode:
-                    return False
-
-                # rA: (x >> 16) & 0x1f
-                if expected_ra is not None and (instruction >> 16) & 0x1f != expected_ra:
-                    return False
-
-            return True
+        addr = self.check_address_hints('static_init_func', self.is_static_init_func)
+        if addr is not None:
+            return addr
 
         SEARCH_START = 0x021C0000
         SEARCH_END = 0x02200000
-        BLOCK_SIZE = 0x8000
 
-        # We search for BLR_BYTES (marking the ends of functions) and
-        # check if what immediately follows them (the start of the next
-        # function) is the static init function
-        for block_start_addr in range(SEARCH_START, SEARCH_END, BLOCK_SIZE):
-            self.source.seek(block_start_addr)
-            block = self.source.read(BLOCK_SIZE)
-
-            for idx in common.iter_bytes_matches(block, BLR_BYTES):
-                if idx % 4 != 0: continue  # if it's not aligned, it's
-                                           # not actually an instruction
-
-                func_start = block_start_addr + idx + 4
-                if check_if_static_init_func(func_start):
-                    return func_start
+        # We search for a blr (marking the end of a function) followed
+        # immediately by the start of the static init function
+        for blr_addr in self.source.iter_word_pattern(STATIC_INIT_FUNC_PATTERN, SEARCH_START, SEARCH_END):
+            return blr_addr + 4
 
 
     def run_interpreter(self) -> dict:
@@ -305,19 +371,39 @@ class NSMBUAnalysis(export_base.Analysis):
         """
         interpreter = TheWorldsWorstPowerPCInterpreter(self.source)
         interpreter.run_function_at(self.static_init_func_addr)
+
+        self.interpreter_stats = {
+            'instructions_executed': interpreter.instructions_executed,
+            'time_spent': interpreter.time_spent,
+        }
+
         return interpreter.memory
 
 
+    def is_table_addr(self, addr: int) -> bool:
+        """
+        Cheaply check if the scripts table is at the given address
+        """
+        if self.source.read_from(addr, len(TABLE_START)) != TABLE_START:
+            return False
+
+        # The marker string should be shortly before it, too
+        return self.source.search(TABLE_MARKER, addr - 0x1000, addr) is not None
+
+
     def find_table_addr(self) -> int:
         """
         Auto-detect the address of the scripts table in memory (e.g.
         0x10044a98 for NSMBU 1.0.0 US).
         Return None if not found.
         """
+        addr = self.check_address_hints('scripts_table', self.is_table_addr)
+        if addr is not None:
+            return addr
+
         # Find "TalkWindow_Sign_00", which is an easily identified string
         # a few hundred bytes before the start of the table
-        window_base = self.source.search(
-            b'TalkWindow_Sign_00', 0x10000000, 0x11000000)
+        window_base = self.source.search(TABLE_MARKER, *self.table_search_range)
 
         if window_base is None:
             # :(
@@ -328,10 +414,7 @@ class NSMBUAnalysis(export_base.Analysis):
         self.source.seek(window_base)
         window = self.source.read(0x1000)
 
-        # Look for a specific byte pattern that indicates the start of the table
-        # (the first script's priority, and the most-significant byte of its pointer)
-        TABLE_START = bytes.fromhex('00 00 00 FF 10')
-
+        # Look for the start of the table
         for offs in range(0, len(window), 4):
             if window[offs : offs+len(TABLE_START)] == TABLE_START:
                 return window_base + offs
@@ -15,8 +15,6 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
-import contextlib
-import pathlib
 import struct
 
 try:
@@ -91,23 +89,29 @@ class NSOFileSource(export_base.SectionedFileSource):
             else:
                 self.sections.append(NSOSectionUncompressed(file, addr, offset, comp_size))
 
+        self.build_section_index()
+
+
+# Formats to check for, in order
+SOURCE_FORMATS = [
+    export_base.SourceFormat(NSOFileSource, lambda header, size: header.startswith(b'NSO0')),
+]
+
+# Folders containing a file with one of these names are RAM dumps
+FOLDER_SOURCES = {}
 
-@contextlib.contextmanager
-def try_open_source(path: pathlib.Path):
-    """
-    Context manager.
-    If the given Path can be recognized as a Source for this game, yield
-    that as the `with` target. Otherwise the `with` target will be None.
-    """
-    if path.is_file():
-        with path.open('rb') as f:
-            # NSO
-            f.seek(0)
-            if f.read(4) == b'NSO0':
-                yield NSOFileSource(f)
-                return
 
-    yield None
+# The first four script priorities in the scripts table (255, 128, 170,
+# 170), with the script pointers in between them
+FIRST_4_PRIORITIES_PATTERN = export_base.WordPattern([
+    export_base.WordPattern.exact(255),
+    export_base.WordPattern.ANY,
+    export_base.WordPattern.exact(128),
+    export_base.WordPattern.ANY,
+    export_base.WordPattern.exact(170),
+    export_base.WordPattern.ANY,
+    export_base.WordPattern.exact(170),
+])
 
 
 class NSMBUDXAnalysis(export_base.Analysis):
@@ -117,35 +121,35 @@ class NSMBUDXAnalysis(export_base.Analysis):
     uses_priorities = True
     uses_static_init_func = False
 
+    table_search_range = (0x00bc0000, 0x00c00000)
+
+    hints_game = common.Game.NSMBU
+    hints_variant_ids = ('DX',)
+
+    def is_table_addr(self, addr: int) -> bool:
+        """
+        Cheaply check if the scripts table is at the given address
+        """
+        words = self.source.read_u32_array(addr, len(FIRST_4_PRIORITIES_PATTERN))
+        return FIRST_4_PRIORITIES_PATTERN.matches(words)
+
+
     def find_table_addr(self) -> int:
         """
         Auto-detect the address of the scripts table in memory (e.g.
         0x00bd5514 for NSMBUDX US).
         Return None if not found.
         """
+        addr = self.check_address_hints('scripts_table', self.is_table_addr)
+        if addr is not None:
+            return addr
+
         # Unlike in the Wii U version, there are no strings near the
         # table which we can search for.
         # Instead, we pattern-match over a wide area on the first four
         # script priority values: 255, 128, 170, 170.
-
-        SEARCH_START = 0x00bc0000
-        SEARCH_END = 0x00c00000
-        FIRST_4_PRIORITIES = [255, 128, 170, 170]
-        ROLLING_WINDOW_SIZE = 7  # enough to match [A, _, B, _, C, _, D]
-
-        rolling_window = []
-
-        self.source.seek(SEARCH_START)
-        for addr in range(SEARCH_START, SEARCH_END, 4):
-            rolling_window.append(self.source.read_u32())
-
-            if len(rolling_window) > ROLLING_WINDOW_SIZE:
-                rolling_window.pop(0)
-
-                every_other_u32 = [rolling_window[i] for i in [0, 2, 4, 6]]
-
-                if every_other_u32 == FIRST_4_PRIORITIES:
-                    return addr - (ROLLING_WINDOW_SIZE - 1) * 4
+        for addr in self.source.iter_word_pattern(FIRST_4_PRIORITIES_PATTERN, *self.table_search_range):
+            return addr
 
 
     def detect_game_variant(self) -> game_variants.GameVariant:
@@ -15,9 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
-import contextlib
 import os
-import pathlib
 import struct
 
 import common
@@ -52,6 +50,8 @@ class DOLFileSource(export_base.SectionedFileSource):
         for offset, addr, size in zip(section_offsets, section_addresses, section_sizes):
             self.sections.append(DOLSection(file, addr, offset, size))
 
+        self.build_section_index()
+
 
 class ALFSection(export_base.SectionedFileSource_UncompressedSection):
     """
@@ -84,6 +84,8 @@ class ALFFileSource(export_base.SectionedFileSource):
             # Skip past the section data
             file.seek(stored_size, os.SEEK_CUR)
 
+        self.build_section_index()
+
 
 class DolphinRAMDumpSource(export_base.SimpleRAMDumpSource):
     """
@@ -95,11 +97,10 @@ class DolphinRAMDumpSource(export_base.SimpleRAMDumpSource):
     base_address = 0x80000000
 
 
-def _detect_dol_from_header(file) -> bool:
+def _detect_dol_from_header(header: bytes, size: int) -> bool:
     """
-    Given a file-like object, try to check if it looks more-or-less like
-    a regular DOL file.
-    (Helper function for try_open_source().)
+    Given the first few bytes of a file, try to check if it looks
+    more-or-less like a regular DOL file.
     """
     PLACES_TO_CHECK = {
         # 0 = "expected to be 00000000", 1 = "expected to be nonzero"
@@ -116,8 +117,7 @@ def _detect_dol_from_header(file) -> bool:
     }
 
     for offs, should_be_nonzero in PLACES_TO_CHECK.items():
-        file.seek(offs)
-        data_here = file.read(4)
+        data_here = header[offs : offs + 4]
         if len(data_here) < 4:
             return False
         value_here, = struct.unpack('>I', data_here)
@@ -127,49 +127,46 @@ def _detect_dol_from_header(file) -> bool:
     return True
 
 
-@contextlib.contextmanager
-def try_open_source(path: pathlib.Path):
-    """
-    Context manager.
-    If the given Path can be recognized as a Source for this game, yield
-    that as the `with` target. Otherwise the `with` target will be None.
-    """
-    if path.is_dir():
-        # Dolphin RAM dump
-        mem1_fp = (path / 'mem1.raw')
-        if mem1_fp.is_file():
-            with mem1_fp.open('rb') as f:
-                yield DolphinRAMDumpSource(f)
-                return
-
-    elif path.is_file():
-        size = path.stat().st_size
-
-        with path.open('rb') as f:
+# Formats to check for, in order
+SOURCE_FORMATS = [
+    export_base.SourceFormat(DolphinRAMDumpSource, lambda header, size: size == 0x01800000),  # 24 MB
+    export_base.SourceFormat(ALFFileSource, lambda header, size: header.startswith(b'RBOF')),
+    export_base.SourceFormat(DOLFileSource, _detect_dol_from_header),
+]
 
-            # Dolphin RAM dump
-            if size == 0x01800000:  # 24 MB
-                yield DolphinRAMDumpSource(f)
-                return
+# Folders containing a file with one of these names are RAM dumps
+FOLDER_SOURCES = {
+    'mem1.raw': DolphinRAMDumpSource,
+}
 
-            # ALF
-            f.seek(0)
-            if f.read(4) == b'RBOF':
-                yield ALFFileSource(f)
-                return
 
-            # DOL
-            if _detect_dol_from_header(f):
-                yield DOLFileSource(f)
-                return
-
-    yield None
+# An easily identified string right at the end of the scripts table
+TABLE_END_MARKER = b'AUTO_SELECT\0WORLD_MAP'
 
 
 class NSMBWAnalysis(export_base.Analysis):
     """
     Analysis subclass for NSMBW
     """
+    hints_game = common.Game.NSMBW
+
+    table_search_range = (0x80300000, 0x80400000)
+
+    def is_table_addr(self, addr: int) -> bool:
+        """
+        Cheaply check if the scripts table is at the given address
+        """
+        # Read from the word before the table up to the marker string
+        window = self.source.read_from(addr - 4, 4 + 0x1000 + len(TABLE_END_MARKER))
+
+        end_offs = window.find(TABLE_END_MARKER, 8)
+        if end_offs == -1 or end_offs % 4 != 0:
+            return False
+
+        # Every word in the table should look like a pointer, and the
+        # word before it shouldn't
+        return window[0] != 0x80 and all(window[offs] == 0x80 for offs in range(4, end_offs, 4))
+
 
     def find_table_addr(self) -> int:
         """
@@ -177,10 +174,13 @@ class NSMBWAnalysis(export_base.Analysis):
         0x8031dbcc for NSMBW PAL v1).
         Return None if not found.
         """
+        addr = self.check_address_hints('scripts_table', self.is_table_addr)
+        if addr is not None:
+            return addr
+
         # Find "AUTO_SELECT\0WORLD_MAP", which is an easily identified
         # string right at the end of the table
-        window_base = self.source.search(
-            b'AUTO_SELECT\0WORLD_MAP', 0x80300000, 0x80400000)
+        window_base = self.source.search(TABLE_END_MARKER, *self.table_search_range)
 
         if window_base is None:
             # :(
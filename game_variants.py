@@ -16,12 +16,31 @@
 # along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
 
 import enum
+import hashlib
 import json
+import marshal
+import os
 import pathlib
+import tempfile
 
 import common
 
 
+# Folder containing the game jsons, relative to this file (not the
+# current working directory)
+DATA_DIR = pathlib.Path(__file__).resolve().parent / 'data'
+
+# Folder for precompiled (marshalled) copies of the game jsons
+PRECOMPILED_DIR = DATA_DIR / '__pycache__'
+
+# Bump this if the format of the precompiled files changes
+PRECOMPILED_VERSION = 1
+
+# {game: ((mtime_ns, size), digest, {variant_name: GameVariant})} for
+# every game json loaded so far in this process
+loaded_games = {}
+
+
 class RenumberingRange:
     """
     Represents a "renumber" entry from one of the jsons, like
@@ -56,20 +75,23 @@ class RenumberingRange:
         return cls(range_start, range_end, offset)
 
 
-    def apply(self, value: int) -> int:
+    def contains(self, value: int) -> bool:
         """
-        Apply this renumbering to the value provided
+        Check if the value provided is within this range
         """
-        offset = 0
-
         if self.range_end is None:
-            if self.range_start <= value:
-                offset = self.offset
+            return self.range_start <= value
         else:
-            if self.range_start <= value <= self.range_end:
-                offset = self.offset
+            return self.range_start <= value <= self.range_end
 
-        return value + offset
+
+    def apply(self, value: int) -> int:
+        """
+        Apply this renumbering to the value provided
+        """
+        if self.contains(value):
+            return value + self.offset
+        return value
 
 
 class NumberedListDiff:
@@ -101,6 +123,94 @@ class NumberedListDiff:
         return cls(renumber, add, delete)
 
 
+    def apply(self, items: dict) -> dict:
+        """
+        Apply this diff to an {id: value} map in the parent's numbering,
+        and return the resulting map
+        """
+        result = {}
+        for id, value in items.items():
+            if id in self.delete:
+                continue
+
+            # Renumbering ranges refer to the parent's IDs
+            for ren in self.renumber:
+                if ren.contains(id):
+                    id = ren.apply(id)
+                    break
+
+            result[id] = value
+
+        result.update(self.add)
+        return result
+
+
+class ResolvedNumberedList:
+    """
+    The complete {id: info} map of scripts or commands in a GameVariant,
+    with all parents' additions, deletions and renumberings already
+    applied, plus reverse lookup tables
+    """
+    by_id: dict
+    id_by_name: dict
+    enum_names_by_id: dict
+
+    def __init__(self, by_id: dict):
+        self.by_id = by_id
+
+        self.id_by_name = {}
+        self.enum_names_by_id = {}
+        for id, info in by_id.items():
+            if 'name' in info:
+                self.id_by_name[info['name']] = id
+
+            if 'enum' in info:
+                # {value: name}, preferring the first name for each value
+                enum_names = {}
+                for name, value in info['enum'].items():
+                    enum_names.setdefault(value, name)
+                self.enum_names_by_id[id] = enum_names
+
+
+    def get_info(self, id: int) -> dict:
+        """
+        Get the info dict for an ID (empty if unknown)
+        """
+        return self.by_id.get(id, {})
+
+
+    def get_enum_name(self, id: int, value: int) -> str:
+        """
+        Get the enum name for an argument value of the item with the
+        specified ID, or None if there isn't one
+        """
+        enum_names = self.enum_names_by_id.get(id)
+        if enum_names is None:
+            return None
+        return enum_names.get(value)
+
+
+class AddressHints:
+    """
+    Known addresses of things in a specific build of a game variant
+    (like "static_init_func" and "scripts_table" in NSMBU 1.0.0 US),
+    which analysis can check before falling back to searching for them
+    """
+    build: str
+    addresses: dict
+
+    def __init__(self, build: str, addresses: dict):
+        self.build = build
+        self.addresses = addresses
+
+    @classmethod
+    def read_from_json(cls, key: str, value: dict):
+        """
+        Create from a json key/value pair
+        """
+        return cls(key, {k: int(v, 16) for k, v in value.items()})
+
+
 class GameVariant:
     """
     A specific version of a game (like "NSMBU 1.3.0")
@@ -111,13 +221,19 @@ class GameVariant:
     name: str = None
     scripts: NumberedListDiff
     commands: NumberedListDiff
+    address_hints: list
+    wmsc_id: str = None
+    resolved_scripts: ResolvedNumberedList = None
+    resolved_commands: ResolvedNumberedList = None
 
-    def __init__(self, id: str, parent: str, name: 'GameVariant', scripts: NumberedListDiff, commands: NumberedListDiff):
+    def __init__(self, id: str, parent: str, name: 'GameVariant', scripts: NumberedListDiff, commands: NumberedListDiff, address_hints: list = None, wmsc_id: str = None):
         self.id = id
         self.parent = parent
         self.name = name
         self.scripts = scripts
         self.commands = commands
+        self.address_hints = [] if address_hints is None else address_hints
+        self.wmsc_id = wmsc_id
 
     @classmethod
     def read_from_json(cls, json_info: dict):
@@ -127,17 +243,92 @@ class GameVariant:
         name = json_info.get('name')
         scripts = NumberedListDiff.read_from_json(json_info.get('scripts', {}))
         commands = NumberedListDiff.read_from_json(json_info.get('commands', {}))
+        address_hints = [AddressHints.read_from_json(k, v) for k, v in json_info.get('address_hints', {}).items()]
+        wmsc_id = json_info.get('wmsc_id')
+
+        return cls(None, None, name, scripts, commands, address_hints, wmsc_id)
+
+
+    def get_resolved_scripts(self) -> ResolvedNumberedList:
+        """
+        Return the ResolvedNumberedList of this variant's scripts
+        (built on first use)
+        """
+        if self.resolved_scripts is None:
+            parent_scripts = {} if self.parent is None else self.parent.get_resolved_scripts().by_id
+            self.resolved_scripts = ResolvedNumberedList(self.scripts.apply(parent_scripts))
+        return self.resolved_scripts
+
 
-        return cls(None, None, name, scripts, commands)
+    def get_resolved_commands(self) -> ResolvedNumberedList:
+        """
+        Return the ResolvedNumberedList of this variant's commands
+        (built on first use)
+        """
+        if self.resolved_commands is None:
+            parent_commands = {} if self.parent is None else self.parent.get_resolved_commands().by_id
+            self.resolved_commands = ResolvedNumberedList(self.commands.apply(parent_commands))
+        return self.resolved_commands
+
+
+def read_game_json(json_path: pathlib.Path, stat: os.stat_result) -> (dict, str):
+    """
+    Read a game json, using its precompiled copy if that's up to date
+    (i.e. it was made from a file with the same mtime and size, or
+    failing that, the same hash), and saving a new one otherwise.
+    Return the parsed json and the SHA-256 hex digest of the file.
+    """
+    precompiled_path = PRECOMPILED_DIR / f'{json_path.name}.marshal'
+
+    try:
+        (version, marshal_version, mtime_ns, size, digest, j) = \
+            marshal.loads(precompiled_path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        version = None
+
+    if version == PRECOMPILED_VERSION and marshal_version == marshal.version:
+        if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):
+            return j, digest
+
+    data = json_path.read_bytes()
+    new_digest = hashlib.sha256(data).hexdigest()
+    if version != PRECOMPILED_VERSION or marshal_version != marshal.version or digest != new_digest:
+        j = json.loads(data.decode('utf-8'))
+
+    # Save the precompiled copy (with the new mtime, if only that
+    # changed). Failures are ignored -- it's only a cache.
+    try:
+        PRECOMPILED_DIR.mkdir(exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=PRECOMPILED_DIR, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((PRECOMPILED_VERSION, marshal.version,
+                    stat.st_mtime_ns, stat.st_size, new_digest, j), f)
+            os.replace(temp_path, precompiled_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except (OSError, ValueError):
+        pass
+
+    return j, new_digest
 
 
 def load_game_json(game: common.Game) -> dict:
     """
-    Load {game}.json and return the dict of {variant_name: GameVariant}
+    Load {game}.json and return the dict of {variant_name: GameVariant}.
+    This is only actually done once per process (unless the file
+    changes), so the returned GameVariants are shared between callers.
     """
+    json_path = DATA_DIR / f'{game.value}.json'
+    stat = json_path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    if game in loaded_games and loaded_games[game][0] == stamp:
+        return loaded_games[game][2]
+
     # Load json
-    with open(f'data/{game.value}.json', 'r', encoding='utf-8') as f:
-        j = json.load(f)
+    j, digest = read_game_json(json_path, stat)
 
     # Load variants individually
     variants = {}
@@ -155,4 +346,14 @@ def load_game_json(game: common.Game) -> dict:
         if parent_name:
             variant.parent = variants[parent_name]
 
+    loaded_games[game] = (stamp, digest, variants)
     return variants
+
+
+def get_game_json_digest(game: common.Game) -> str:
+    """
+    Return the SHA-256 hex digest of {game}.json, for use in cache keys
+    of things derived from it
+    """
+    load_game_json(game)
+    return loaded_games[game][1]
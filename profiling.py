@@ -0,0 +1,155 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import dataclasses
+import json
+import sys
+import time
+
+
+@dataclasses.dataclass
+class PhaseStats:
+    """
+    Cost of a single phase of analysis or exporting
+    """
+    name: str
+    wall_time: float = 0.0
+    seeks: int = 0
+    reads: int = 0
+    bytes_read: int = 0
+    bytes_decompressed: int = 0
+    section_lookups: int = 0
+    section_fast_hits: int = 0
+    section_linear_scans: int = 0
+
+
+class Profiler:
+    """
+    Records wall time and I/O counts for named phases of work on a
+    Source
+    """
+    def __init__(self, source):
+        self.source = source
+        self.phases = []
+
+
+    def snapshot(self) -> tuple:
+        """
+        Return the current values of the source's I/O counters
+        """
+        return (
+            self.source.seek_count,
+            self.source.read_count,
+            self.source.bytes_read,
+            self.source.get_bytes_decompressed(),
+            *self.source.get_section_lookup_counts(),
+        )
+
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Context manager that records the cost of the code within it as
+        a phase with the given name
+        """
+        before = self.snapshot()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_time
+            after = self.snapshot()
+            self.phases.append(PhaseStats(name, wall_time, *(a - b for a, b in zip(after, before))))
+
+
+    def to_json(self) -> dict:
+        """
+        Return a dict representing the report, suitable for saving as
+        json
+        """
+        return {
+            'source': self.source.name,
+            'phases': [dataclasses.asdict(phase) for phase in self.phases],
+        }
+
+
+    def format_table(self) -> str:
+        """
+        Return the report as a human-readable table
+        """
+        HEADERS = ['Phase', 'Time (ms)', 'Seeks', 'Reads', 'Bytes read', 'Bytes decompressed']
+        SECTION_HEADERS = ['Section lookups', 'Fast hits', 'Linear scans']
+
+        total = PhaseStats('(total)')
+        for phase in self.phases:
+            total.wall_time += phase.wall_time
+            total.seeks += phase.seeks
+            total.reads += phase.reads
+            total.bytes_read += phase.bytes_read
+            total.bytes_decompressed += phase.bytes_decompressed
+            total.section_lookups += phase.section_lookups
+            total.section_fast_hits += phase.section_fast_hits
+            total.section_linear_scans += phase.section_linear_scans
+
+        # Only sources with sections do section lookups
+        show_sections = (total.section_lookups > 0)
+        if show_sections:
+            HEADERS = HEADERS + SECTION_HEADERS
+
+        def row_for(phase: PhaseStats) -> list:
+            row = [
+                phase.name,
+                f'{phase.wall_time * 1000:.1f}',
+                str(phase.seeks),
+                str(phase.reads),
+                str(phase.bytes_read),
+                str(phase.bytes_decompressed),
+            ]
+            if show_sections:
+                row.extend([
+                    str(phase.section_lookups),
+                    str(phase.section_fast_hits),
+                    str(phase.section_linear_scans),
+                ])
+            return row
+
+        rows = [row_for(phase) for phase in self.phases] + [row_for(total)]
+
+        widths = [max(len(row[i]) for row in [HEADERS] + rows) for i in range(len(HEADERS))]
+
+        def format_row(row: list) -> str:
+            # Left-align the phase name, right-align the numbers
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(w) for cell, w in zip(row[1:], widths[1:])]
+            return '  '.join(cells)
+
+        lines = [format_row(HEADERS), '  '.join('-' * w for w in widths)]
+        lines.extend(format_row(row) for row in rows)
+        return '\n'.join(lines)
+
+
+    def print_report(self, format: str):
+        """
+        Print the report, either as a 'table' or as 'json'. The json
+        report goes to stderr, so that it can be parsed separately from
+        everything else that's printed.
+        """
+        if format == 'json':
+            print(json.dumps(self.to_json(), indent=4), file=sys.stderr)
+        else:
+            print()
+            print(self.format_table())
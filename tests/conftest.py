@@ -0,0 +1,22 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+import sys
+
+# Cobra's modules are at the top level of the repo, not in a package
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
@@ -0,0 +1,67 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+
+import batch
+
+
+def make_files(root: pathlib.Path, names: list):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'\0' * 0x20)
+
+
+def test_output_dir_keeps_subdirectories(tmp_path):
+    make_files(tmp_path / 'in', ['us/main.rpx', 'eu/main.rpx', 'top.dol', 'us/main.txt'])
+
+    inputs = batch.expand_input_paths([tmp_path / 'in'])
+    assert [rel for _, rel in inputs] == [
+        pathlib.Path('eu/main.rpx'), pathlib.Path('top.dol'), pathlib.Path('us/main.rpx')]
+
+    out = tmp_path / 'out'
+    assert batch.get_output_bases(inputs, out) == [out / 'eu/main', out / 'top', out / 'us/main']
+
+
+def test_colliding_outputs_get_unique_names(tmp_path):
+    make_files(tmp_path, ['a/main.rpx', 'b/main.rpx', 'a/main.dol', 'a/MAIN.nso'])
+
+    # Same relative path from two input directories, and the same stem
+    # in one directory
+    inputs = batch.expand_input_paths([tmp_path / 'a', tmp_path / 'b'])
+    out = tmp_path / 'out'
+    bases = batch.get_output_bases(inputs, out)
+    assert bases == [out / 'MAIN', out / 'main.dol', out / 'main.rpx', out / 'main.rpx-2']
+
+    # Next to the inputs, only files in the same directory can collide
+    bases = batch.get_output_bases(inputs)
+    assert bases == [
+        tmp_path / 'a/MAIN', tmp_path / 'a/main.dol', tmp_path / 'a/main.rpx', tmp_path / 'b/main']
+
+
+def test_run_one_forwards_options(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(batch.export, 'do_analyze', lambda path, **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(batch.export, 'do_export', lambda path, txt, json, **kwargs: calls.append(kwargs))
+
+    for command in ['analyze', 'export']:
+        result = batch.run_one(command, tmp_path / 'main.rpx', tmp_path / 'main',
+            profile='table', table_search_range=(0x10000000, 0x10100000))
+        assert result.ok
+
+    assert calls == [{'profile': 'table', 'table_search_range': (0x10000000, 0x10100000)}] * 2
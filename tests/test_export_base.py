@@ -0,0 +1,50 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+
+import pytest
+
+import common
+import export_base
+
+
+class OneSectionSource(export_base.SectionedFileSource):
+    name = 'one-section test file'
+    game = common.Game.NSMBU
+    endian = '>'
+
+    def __init__(self, file, size: int):
+        super().__init__(file)
+        self.sections.append(export_base.SectionedFileSource_UncompressedSection(file, 0, 0, size))
+        self.build_section_index()
+
+
+@pytest.fixture
+def source():
+    data = b''.join(i.to_bytes(4, 'big') for i in range(0x400))
+    return OneSectionSource(io.BytesIO(data), len(data))
+
+
+def test_iter_u32_stops_at_end_of_last_block(source):
+    assert list(source.iter_u32(0, None)) == list(range(0x400))
+    assert list(source.iter_u32(0, None, block_count=0x100)) == list(range(0x400))
+
+
+def test_iter_u32_at_end_of_readable_memory(source):
+    assert list(source.iter_u32(0x1000, None)) == []
+    assert list(source.iter_u32(0xff8, 10)) == [0x3fe, 0x3ff]
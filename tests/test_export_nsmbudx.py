@@ -0,0 +1,89 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+
+import pytest
+
+import common
+import export
+import export_base
+import export_nsmbudx
+
+
+BASE_ADDRESS = 0x00800000
+TABLE_ADDR = 0x00c10000  # outside of the default search range
+
+
+class NSMBUDXRAMDumpSource(export_base.SimpleRAMDumpSource):
+    name = 'NSMBUDX test RAM dump'
+    game = common.Game.NSMBUDX
+    endian = '<'
+    base_address = BASE_ADDRESS
+
+
+@pytest.fixture
+def source(tmp_path):
+    data = bytearray(0x00500000)
+    # Scripts table entries: (priority, pointer)
+    struct.pack_into('<8I', data, TABLE_ADDR - BASE_ADDRESS,
+        255, 0x01000000, 128, 0x01000010, 170, 0x01000020, 170, 0x01000030)
+
+    path = tmp_path / 'ram.bin'
+    path.write_bytes(data)
+    with path.open('rb') as f:
+        source = NSMBUDXRAMDumpSource(f)
+        yield source
+        source.close()
+
+
+def test_default_table_search_range_misses_table(source):
+    analysis = export_nsmbudx.NSMBUDXAnalysis(source)
+    assert analysis.table_search_range == (0x00bc0000, 0x00c00000)
+    assert analysis.find_table_addr() is None
+
+
+def test_custom_table_search_range_finds_table(source):
+    analysis = export.get_analysis_for_source(source, table_search_range=(0x00c00000, 0x00c20000))
+    assert analysis.find_table_addr() == TABLE_ADDR
+
+    # The range is per instance
+    assert export_nsmbudx.NSMBUDXAnalysis.table_search_range == (0x00bc0000, 0x00c00000)
+
+
+def test_table_must_start_within_range(source):
+    analysis = export_nsmbudx.NSMBUDXAnalysis(source, table_search_range=(0x00c00000, TABLE_ADDR))
+    assert analysis.find_table_addr() is None
+
+    analysis = export_nsmbudx.NSMBUDXAnalysis(source, table_search_range=(TABLE_ADDR, TABLE_ADDR + 4))
+    assert analysis.find_table_addr() == TABLE_ADDR
+
+
+def test_invalid_table_search_range(source):
+    with pytest.raises(ValueError):
+        export_nsmbudx.NSMBUDXAnalysis(source, table_search_range=(0x00c20000, 0x00c00000))
+
+
+def test_analysis_cache_key_depends_on_table_search_range(source, monkeypatch):
+    default_key = export.get_analysis_cache_key(export.get_analysis_for_source(source))
+    custom_key = export.get_analysis_cache_key(
+        export.get_analysis_for_source(source, table_search_range=(0x00c00000, 0x00c20000)))
+    assert default_key != custom_key
+
+    # ...and on the game json
+    monkeypatch.setattr(export.game_variants, 'get_game_json_digest', lambda game: '0' * 64)
+    assert export.get_analysis_cache_key(export.get_analysis_for_source(source)) != default_key
@@ -0,0 +1,346 @@
+# Copyright 2021 RoadrunnerWMC
+#
+# This file is part of Cobra.
+#
+# Cobra is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cobra is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cobra.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import collections.abc
+import io
+import mmap
+import pathlib
+import sys
+
+import common
+import game_variants
+
+
+MAGIC = b'WMS'
+VERSION = b'0'
+
+# Game characters in .wmsc headers (see the readme)
+GAMES_BY_CODE = {
+    'W': common.Game.NSMBW,
+    '2': common.Game.NSMB2,
+    'U': common.Game.NSMBU,
+    'X': common.Game.NSMBUDX,
+}
+
+# magic, version, game, gameVariant, fileSize, numScripts
+HEADER_SIZE = 3 + 1 + 1 + 3 + 4 + 4
+
+NATIVE_ENDIAN = '>' if sys.byteorder == 'big' else '<'
+
+
+def split_wmsc_id(wmsc_id: str) -> (common.Game, str):
+    """
+    Split a game variant's four-character .wmsc ID (like "U130") into
+    the game it's for and the three-character game variant identifier
+    """
+    if wmsc_id is None or len(wmsc_id) != 4 or not wmsc_id.isascii():
+        raise ValueError(f'Invalid .wmsc ID: {wmsc_id!r}')
+    if wmsc_id[0] not in GAMES_BY_CODE:
+        raise ValueError(f'Unknown .wmsc game character: {wmsc_id[0]!r}')
+    return GAMES_BY_CODE[wmsc_id[0]], wmsc_id[1:]
+
+
+def get_variant_wmsc_id(variant: game_variants.GameVariant) -> str:
+    """
+    Return the .wmsc ID of a GameVariant, or raise ValueError if it
+    doesn't have one
+    """
+    if variant.wmsc_id is None:
+        raise ValueError(f'No .wmsc game variant identifier is defined for {variant.game.value} {variant.id}')
+    return variant.wmsc_id
+
+
+def encode_header(wmsc_id: str, file_size: int, num_scripts: int) -> bytes:
+    """
+    Encode a .wmsc header, up to and including numScripts
+    """
+    game, _ = split_wmsc_id(wmsc_id)
+    return (MAGIC + VERSION + wmsc_id.encode('ascii')
+        + common.encode_u32_array([file_size, num_scripts], game.endian()))
+
+
+def byteswap_u32(value: int) -> int:
+    """
+    Reverse the byte order of a u32
+    """
+    return int.from_bytes(value.to_bytes(4, 'little'), 'big')
+
+
+class ByteswappedU32View(collections.abc.Sequence):
+    """
+    A read-only sequence wrapping a memoryview of u32s in the opposite
+    of the native byte order, which byteswaps values as they're accessed
+    """
+    __slots__ = ('view',)
+
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(self.view[index])
+        return byteswap_u32(self.view[index])
+
+
+def get_u32_view(view: memoryview, endian: str) -> collections.abc.Sequence:
+    """
+    Return a zero-copy sequence of the u32s in a memoryview of bytes
+    with the given endianness
+    """
+    u32s = view.cast(common.U32_TYPECODE)
+    if endian == NATIVE_ENDIAN:
+        return u32s
+    return ByteswappedU32View(u32s)
+
+
+class WMSCScript(collections.abc.Sequence):
+    """
+    A lazy, read-only view of one script's commands in a .wmsc file.
+    Like common.LowLevelScript, LowLevelCommands are only created when
+    accessed.
+    """
+    __slots__ = ('words', 'priority')
+
+    words: collections.abc.Sequence
+    priority: int
+
+    def __init__(self, words: collections.abc.Sequence, priority: int):
+        self.words = words
+        self.priority = priority
+
+
+    def iter_pairs(self):
+        """
+        Iterate over (ID, argument) tuples, without creating
+        LowLevelCommands
+        """
+        return zip(self.words[0::2], self.words[1::2])
+
+
+    def to_low_level(self) -> common.LowLevelScript:
+        """
+        Copy the commands to a common.LowLevelScript
+        """
+        script = common.LowLevelScript.from_words(self.words)
+        script.priority = self.priority
+        return script
+
+
+    def __len__(self) -> int:
+        return len(self.words) // 2
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        return common.LowLevelCommand(self.words[index * 2], self.words[index * 2 + 1])
+
+
+    def __iter__(self):
+        for id, argument in self.iter_pairs():
+            yield common.LowLevelCommand(id, argument)
+
+
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self)!r})'
+
+
+class WMSCFile(collections.abc.Mapping):
+    """
+    A read-only {script_id: WMSCScript} view of .wmsc file data. Nothing
+    is copied or decoded up front: scripts are found by binary-searching
+    the IDs table in place, and their commands are views into the data.
+    Use WMSCFile.open() to memory-map a file.
+    """
+    game: common.Game
+    variant_code: str
+    endian: str
+    uses_priorities: bool
+
+    def __init__(self, data, *, variant: game_variants.GameVariant = None):
+        """
+        data can be any bytes-like object (including an mmap). If
+        variant is specified, raise ValueError if the file is for a
+        different game variant.
+        """
+        self.mapping = None
+        self.ids = self.table = None
+        self.script_starts = None
+
+        self.view = memoryview(data)
+        try:
+            self.read_header(variant)
+        except BaseException:
+            self.close()
+            raise
+
+
+    @classmethod
+    def open(cls, path: pathlib.Path, *, variant: game_variants.GameVariant = None):
+        """
+        Memory-map a .wmsc file (or just read it, if it can't be mapped)
+        """
+        with path.open('rb') as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # An empty file, or a platform that doesn't support
+                # mmap -- just read it instead
+                return cls(f.read(), variant=variant)
+
+        try:
+            wmsc = cls(mapping, variant=variant)
+        except BaseException:
+            mapping.close()
+            raise
+        wmsc.mapping = mapping
+        return wmsc
+
+
+    def read_header(self, variant: game_variants.GameVariant):
+        """
+        Check the header and set up views of the IDs and scripts tables
+        """
+        view = self.view
+
+        if len(view) < HEADER_SIZE or view[:3] != MAGIC:
+            raise ValueError('Not a .wmsc file')
+        if view[3:4] != VERSION:
+            raise ValueError(f'Unsupported .wmsc version: {bytes(view[3:4])!r}')
+
+        wmsc_id = bytes(view[4:8]).decode('ascii', 'replace')
+        self.game, self.variant_code = split_wmsc_id(wmsc_id)
+        if variant is not None and wmsc_id != get_variant_wmsc_id(variant):
+            raise ValueError(f'This .wmsc file is for a different game variant ({wmsc_id}, not {variant.wmsc_id})')
+
+        self.endian = self.game.endian()
+        self.uses_priorities = self.game.uses_script_priorities()
+
+        file_size, num_scripts = get_u32_view(view[8:HEADER_SIZE], self.endian)
+        if file_size > len(view):
+            raise ValueError(f'.wmsc file is truncated ({len(view)} bytes, should be {file_size})')
+        self.view = view = view[:file_size]
+
+        table_entry_len = (8 if self.uses_priorities else 4)
+        ids_end = HEADER_SIZE + 4 * num_scripts
+        self.data_start = ids_end + table_entry_len * num_scripts
+        if self.data_start > file_size:
+            raise ValueError(f'.wmsc file is too small for {num_scripts} scripts')
+
+        self.ids = get_u32_view(view[HEADER_SIZE:ids_end], self.endian)
+        self.table = get_u32_view(view[ids_end:self.data_start], self.endian)
+
+
+    def close(self):
+        """
+        Release the data (and the memory mapping, if there is one)
+        """
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        self.ids = self.table = None
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                # Some WMSCScripts are still in use. They keep the
+                # mapping alive, and it'll be unmapped once they're gone.
+                pass
+            self.mapping = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def find_script_index(self, id: int) -> int:
+        """
+        Return the index of the script with the specified ID in the IDs
+        table, or None if there isn't one
+        """
+        index = bisect.bisect_left(self.ids, id)
+        if index < len(self.ids) and self.ids[index] == id:
+            return index
+        return None
+
+
+    def get_start_offsets(self) -> collections.abc.Sequence:
+        """
+        Return a view of the scripts' start offsets, in table order
+        """
+        return self.table[1::2] if self.uses_priorities else self.table
+
+
+    def get_script_at(self, index: int) -> WMSCScript:
+        """
+        Return a WMSCScript for the script at the specified index in the
+        IDs table
+        """
+        if self.uses_priorities:
+            priority, start = self.table[index * 2 : index * 2 + 2]
+        else:
+            priority, start = 0, self.table[index]
+
+        if not self.data_start <= start <= len(self.view) or start % 4:
+            raise ValueError(f'Script {self.ids[index]} has an invalid start offset: 0x{start:x}')
+
+        # Scripts are stored in table order by encode.assemble_wmsc(),
+        # so each one ends where the next one in the table begins
+        # (which also works for empty scripts). Other files might not
+        # be, so never go past the next start offset after this one.
+        if self.script_starts is None:
+            self.script_starts = sorted(set(self.get_start_offsets()))
+        next_index = bisect.bisect_right(self.script_starts, start)
+        if next_index < len(self.script_starts):
+            end = self.script_starts[next_index]
+        else:
+            end = len(self.view)
+        if index + 1 < len(self.ids):
+            next_start = self.get_start_offsets()[index + 1]
+            if start <= next_start < end:
+                end = next_start
+        end -= (end - start) % 8
+
+        return WMSCScript(get_u32_view(self.view[start:end], self.endian), priority)
+
+
+    def __getitem__(self, id: int) -> WMSCScript:
+        index = self.find_script_index(id)
+        if index is None:
+            raise KeyError(id)
+        return self.get_script_at(index)
+
+
+    def __contains__(self, id) -> bool:
+        return isinstance(id, int) and self.find_script_index(id) is not None
+
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+    def __len__(self) -> int:
+        return len(self.ids)